@@ -1,3 +1,5 @@
+import heapq
+
 import numpy as np
 
 
@@ -45,12 +47,18 @@ class GeneralQLearningAgent:
         if np.random.rand() < exploration_rate:
             return np.random.choice(actions)  # Random action selection
         else:
-            hashable_state = self.make_hashable(state)
-            q_values = self.q_table.get(hashable_state, {})  # Default to empty dict if state not in table
-            if not q_values:  # If there are no Q-values for this state, return a random action
-                return np.random.choice(actions)
-            best_actions = [action for action in q_values if q_values[action] == max(q_values.values())]
-            return np.random.choice(best_actions)  # Randomly choose from the best actions
+            return self.greedy_action(state)
+
+    def greedy_action(self, state):
+        """
+        The action with the highest Q-value, with no exploration.
+        """
+        hashable_state = self.make_hashable(state)
+        q_values = self.q_table.get(hashable_state, {})  # Default to empty dict if state not in table
+        if not q_values:  # If there are no Q-values for this state, return a random action
+            return np.random.choice(self.actions_func())
+        best_actions = [action for action in q_values if q_values[action] == max(q_values.values())]
+        return np.random.choice(best_actions)  # Randomly choose from the best actions
 
     def update_q_table(self, state, action, next_state, reward):
         hashable_state = self.make_hashable(state)
@@ -72,6 +80,125 @@ class GeneralQLearningAgent:
             self.q_table[hashable_state] = {}
         self.q_table[hashable_state][action] = new_q_value
 
+def encode_position_state(state):
+    """
+    A quick state_encoder for maze states like {"position": [x, y]} or {"position": [x, y], "has_key": True}.
+    """
+    return (state["position"][0], state["position"][1], state.get("has_key", False))
+
+
+class CompactQLearningAgent(GeneralQLearningAgent):
+    """
+    Does the same thing as GeneralQLearningAgent, but stores the q-values far more compactly. The
+    exploration rate, episode counting and make_hashable come straight from GeneralQLearningAgent.
+
+    Each new state is given an integer id the first time we see it, and the q-values live in one
+    float32 array with a row per state id that grows as more states turn up. The best q-value of
+    every state is kept up to date as we go, so we never have to search for it.
+
+    By default states are turned into dictionary keys with make_hashable, like GeneralQLearningAgent.
+    If you know what your states look like you can pass a quicker state_encoder, for example
+    encode_position_state for the mazes.
+    """
+
+    def __init__(self,
+                 actions_func,
+                 learning_rate=0.1,
+                 discount_factor=0.9,
+                 exploration_start=1.0,
+                 exploration_end=0.01,
+                 num_episodes=100,
+                 state_encoder=None,
+                 initial_capacity=1024,
+                 dtype=np.float32):
+        super().__init__(actions_func, learning_rate, discount_factor, exploration_start, exploration_end, num_episodes)
+        self.actions = list(actions_func())
+        self.actions_map = {action: ix for ix, action in enumerate(self.actions)}
+        self.num_actions = len(self.actions)
+        self.state_encoder = state_encoder if state_encoder is not None else self.make_hashable
+        self.state_ids = {}  # state key -> row of the q_table
+        self.num_states = 0
+        self.q_table = np.zeros((initial_capacity, self.num_actions), dtype=dtype)
+        self.has_value = np.zeros((initial_capacity, self.num_actions), dtype=bool)  # Which actions have been tried in each state
+        self.best_values = []  # Best q-value of the tried actions in each state (-inf until one has been tried)
+
+    def state_id(self, state):
+        """
+        The q_table row for a state, giving it a new row if we haven't seen it before.
+        """
+        key = self.state_encoder(state)
+        state_id = self.state_ids.get(key)
+        if state_id is None:
+            state_id = self.num_states
+            if state_id == len(self.q_table):
+                self.grow()
+            self.state_ids[key] = state_id
+            self.best_values.append(-np.inf)
+            self.num_states += 1
+        return state_id
+
+    def grow(self):
+        """
+        Double the number of rows in the q_table.
+        """
+        capacity = 2 * len(self.q_table)
+        self.q_table = np.resize(self.q_table, (capacity, self.num_actions))
+        self.q_table[self.num_states:] = 0
+        self.has_value = np.resize(self.has_value, (capacity, self.num_actions))
+        self.has_value[self.num_states:] = False
+
+    def get_action(self, state):
+        exploration_rate = self.get_exploration_rate()
+        actions = self.actions_func()
+        if np.random.rand() < exploration_rate:
+            return actions[np.random.randint(len(actions))]  # Random action selection
+        else:
+            return self.greedy_action(state)
+
+    def greedy_action(self, state):
+        """
+        The action with the highest Q-value, with no exploration.
+        """
+        state_id = self.state_ids.get(self.state_encoder(state))
+        if state_id is None or self.best_values[state_id] == -np.inf:  # If there are no Q-values for this state, return a random action
+            actions = self.actions_func()
+            return actions[np.random.randint(len(actions))]
+        best_value = self.best_values[state_id]
+        q_values = self.q_table[state_id].tolist()
+        tried = self.has_value[state_id].tolist()
+        best_actions = [self.actions[ix] for ix in range(self.num_actions) if tried[ix] and q_values[ix] == best_value]
+        return best_actions[np.random.randint(len(best_actions))]  # Randomly choose from the best actions
+
+    def update_q_table(self, state, action, next_state, reward):
+        state_id = self.state_id(state)
+        next_state_id = self.state_id(next_state)
+        action_ix = self.actions_map[action]
+
+        current_q_value = self.q_table.item(state_id, action_ix)
+        best_next_action_q_value = self.best_values[next_state_id]
+        if best_next_action_q_value == -np.inf:
+            best_next_action_q_value = 0
+
+        new_q_value = current_q_value + self.learning_rate * (reward + self.discount_factor * best_next_action_q_value - current_q_value)
+        self.q_table[state_id, action_ix] = new_q_value
+        self.has_value[state_id, action_ix] = True
+        new_q_value = self.q_table.item(state_id, action_ix)  # As stored, in the dtype of the table
+
+        # Keep the best value of the state up to date
+        if new_q_value >= self.best_values[state_id]:
+            self.best_values[state_id] = new_q_value
+        elif current_q_value == self.best_values[state_id]:
+            self.best_values[state_id] = float(self.q_table[state_id][self.has_value[state_id]].max())
+
+    def as_dict(self):
+        """
+        The q-values in the same {state key: {action: q-value}} layout GeneralQLearningAgent uses.
+        """
+        q_table = {}
+        for key, state_id in self.state_ids.items():
+            q_table[key] = {self.actions[ix]: float(self.q_table[state_id, ix]) for ix in np.flatnonzero(self.has_value[state_id])}
+        return q_table
+
 class QLearningAgent:
 
     """
@@ -89,13 +216,22 @@ class QLearningAgent:
                  discount_factor=0.9,
                  exploration_start=1.0,
                  exploration_end=0.01,
-                 num_episodes=100):
+                 num_episodes=100,
+                 dtype=np.float64,
+                 q_table_file=None):
         # Initialize the Q-learning agent with a Q-table containing all zeros
         # where the rows represent states, columns represent actions, and the third dimension is for each action
         self.actions = actions  # Store available actions
         self.actions_map = {action: ix for ix, action in enumerate(actions)}
         self.num_actions = len(actions)  # Number of possible actions
-        self.q_table = np.zeros((maze.maze_height, maze.maze_width, self.num_actions))
+        # The table is looked up as q_table[x, y, action], so the first dimension runs across the width of the maze
+        # For huge mazes the table can be float32 or float16 (float16 only keeps about 3 significant digits),
+        # and q_table_file puts it in a memory mapped .npy file instead of in memory
+        shape = self.table_shape(maze)
+        if q_table_file is not None:
+            self.q_table = np.lib.format.open_memmap(q_table_file, mode="w+", dtype=dtype, shape=shape)
+        else:
+            self.q_table = np.zeros(shape, dtype=dtype)
         self.learning_rate = learning_rate          # Learning rate controls how much the agent updates its Q-values after each action
         self.discount_factor = discount_factor      # Discount factor determines the importance of future rewards in the agent's decisions
         self.exploration_start = exploration_start  # Exploration rate determines the likelihood of the agent taking a random action
@@ -103,6 +239,9 @@ class QLearningAgent:
         self.num_episodes = num_episodes
         self.current_episode = 0
 
+    def table_shape(self, maze):
+        return (maze.maze_width, maze.maze_height, self.num_actions)
+
     def new_episode(self):
         self.current_episode += 1
 
@@ -115,13 +254,17 @@ class QLearningAgent:
         return exploration_rate
 
     def get_action(self, state): # State is tuple representing where agent is in maze (x, y)
-        position = state["position"]
         exploration_rate = self.get_exploration_rate()
         # Select an action for the given state either randomly (exploration) or using the Q-table (exploitation)
         if np.random.rand() < exploration_rate:
             return self.actions[np.random.randint(self.num_actions)] # Choose a random action based on number of available actions
         else:
-            return self.actions[np.argmax(self.q_table[position[0], position[1], :])] # Choose the action with the highest Q-value for the given state
+            return self.greedy_action(state)
+
+    def greedy_action(self, state):
+        # Choose the action with the highest Q-value for the given state, without exploring
+        position = state["position"]
+        return self.actions[np.argmax(self.q_table[position[0], position[1], :])]
 
     def update_q_table(self, state, action, next_state, reward):
         next_state = next_state["position"]
@@ -139,4 +282,143 @@ class QLearningAgent:
         # Update the Q-table with the new Q-value for the current state and action
         self.q_table[state[0], state[1], action_ix] = new_q_value
 
+class StateQLearningAgent(QLearningAgent):
+    """
+    A QLearningAgent with q-values for every state of the maze, not just every position, so it can
+    learn a KeyMaze or an ItemMaze properly: the same cell is worth something different depending on
+    which keys we hold.
+
+    The table is q_table[layer, x, y, action], with one layer for each inventory (for a KeyMaze:
+    without and with the key). Flattened to q_table.reshape(-1, num_actions) its rows are the maze's
+    state ids, so it works with train_agent_fast and the other code that uses the maze's tables.
+    """
+
+    def __init__(self, maze, actions, *args, **kwargs):
+        super().__init__(maze, actions, *args, **kwargs)
+        self.maze_height = maze.maze_height
+        self.num_positions = maze.num_positions
+
+    def table_shape(self, maze):
+        return (maze.num_states // maze.num_positions, maze.maze_width, maze.maze_height, self.num_actions)
+
+    def state_row(self, state):
+        position = state["position"]
+        layer = state["inventory"] if "inventory" in state else state.get("has_key", 0)
+        return int(layer) * self.num_positions + position[0] * self.maze_height + position[1]
+
+    def greedy_action(self, state):
+        return self.actions[np.argmax(self.q_table.reshape(-1, self.num_actions)[self.state_row(state)])]
+
+    def update_q_table(self, state, action, next_state, reward):
+        q_rows = self.q_table.reshape(-1, self.num_actions)
+        row = self.state_row(state)
+        action_ix = self.actions_map[action]
+        target = reward + self.discount_factor * q_rows[self.state_row(next_state)].max()
+        q_rows[row, action_ix] += self.learning_rate * (target - q_rows[row, action_ix])
+
+
+class PrioritizedSweepingAgent(QLearningAgent):
+    """
+    A QLearningAgent that also remembers what every move did, and uses that memory to practise in
+    its head between real steps (this is called planning, or Dyna-Q).
+
+    The memory is two arrays: model_next[state, action], the state the move led to (-1 if it has
+    never been tried), and model_reward[state, action], the reward it gave. Every state also keeps
+    a list of the (state, action) moves that lead into it.
+
+    After each real step the agent works out which remembered moves would now change their q-value
+    the most, and puts them in a priority queue (biggest change first). It then does up to
+    planning_steps updates from the queue. When a q-value changes, the moves leading into that state
+    are queued too, so news of the goal spreads backwards along the whole path in one go instead of
+    one step per visit (prioritized sweeping).
+
+    The maze never changes, so remembered moves are exact and planned updates can jump all the
+    way to their target (planning_learning_rate=1).
+
+    States are positions, so this is meant for a Maze: on a KeyMaze the same position leads to
+    different rewards with and without the key.
+    """
+
+    def __init__(self,
+                 maze,
+                 actions,
+                 learning_rate=0.1,
+                 discount_factor=0.9,
+                 exploration_start=1.0,
+                 exploration_end=0.01,
+                 num_episodes=100,
+                 planning_steps=50,
+                 planning_learning_rate=1.0,
+                 priority_threshold=1e-4,
+                 dtype=np.float64,
+                 q_table_file=None):
+        super().__init__(maze, actions, learning_rate, discount_factor, exploration_start, exploration_end, num_episodes, dtype, q_table_file)
+        self.maze_height = maze.maze_height
+        num_rows = maze.maze_width * maze.maze_height
+        self.planning_steps = planning_steps
+        self.planning_learning_rate = planning_learning_rate
+        self.priority_threshold = priority_threshold
+        self.model_next = np.full((num_rows, self.num_actions), -1, dtype=np.int32)
+        self.model_reward = np.zeros((num_rows, self.num_actions), dtype=dtype)
+        self.predecessors = [[] for _ in range(num_rows)]  # state -> [(state, action) moves that lead into it]
+        self.queued_priority = np.zeros((num_rows, self.num_actions))  # Priority a move is queued with, 0 if it isn't
+        self.queue = []  # Heap of (-priority, state, action)
+        self.planning_updates = 0
+
+    def state_row(self, state):
+        position = state["position"]
+        return position[0] * self.maze_height + position[1]
+
+    def td_error(self, q_rows, row, action_ix):
+        """
+        How far the q-value of a remembered move is from what the memory says it should be.
+        """
+        next_row = self.model_next[row, action_ix]
+        target = self.model_reward[row, action_ix] + self.discount_factor * q_rows[next_row].max()
+        return target - q_rows[row, action_ix]
+
+    def queue_move(self, q_rows, row, action_ix):
+        priority = abs(self.td_error(q_rows, row, action_ix))
+        if priority > self.priority_threshold and priority > self.queued_priority[row, action_ix]:
+            self.queued_priority[row, action_ix] = priority
+            heapq.heappush(self.queue, (-priority, row, action_ix))
+
+    def queue_predecessors(self, q_rows, row):
+        for previous_row, action_ix in self.predecessors[row]:
+            self.queue_move(q_rows, previous_row, action_ix)
+
+    def update_q_table(self, state, action, next_state, reward):
+        # The normal Q-learning update for the real step
+        super().update_q_table(state, action, next_state, reward)
+
+        # Remember what the move did
+        row = self.state_row(state)
+        next_row = self.state_row(next_state)
+        action_ix = self.actions_map[action]
+        if self.model_next[row, action_ix] < 0:
+            self.model_next[row, action_ix] = next_row
+            self.predecessors[next_row].append((row, action_ix))
+        self.model_reward[row, action_ix] = reward
+
+        # The q-value of this state changed, so the moves into it (and maybe this one) need another look
+        q_rows = self.q_table.reshape(-1, self.num_actions)
+        self.queue_move(q_rows, row, action_ix)
+        self.queue_predecessors(q_rows, row)
+        self.plan(q_rows)
+
+    def plan(self, q_rows):
+        """
+        Do up to planning_steps updates from remembered moves, the most urgent first.
+        """
+        updates = 0
+        while self.queue and updates < self.planning_steps:
+            priority, row, action_ix = heapq.heappop(self.queue)
+            if -priority != self.queued_priority[row, action_ix]:
+                continue  # Queued again since with a bigger priority, this entry is out of date
+            self.queued_priority[row, action_ix] = 0.0
+            q_rows[row, action_ix] += self.planning_learning_rate * self.td_error(q_rows, row, action_ix)
+            updates += 1
+            self.queue_predecessors(q_rows, row)
+        self.planning_updates += updates
+
 print("This code block has been run and the QLearningAgent class is now available for use.")
@@ -0,0 +1,217 @@
+"""
+How fast is everything?
+
+Times stepping through the mazes, the agents' get_action and update_q_table, and whole training
+runs, on mazes from the small example maze up to big prims mazes. For each one it reports steps per
+second, episodes per second (for training) and the peak memory used, and saves it all as JSON so
+the numbers can be compared between commits.
+
+From the command line:
+    python benchmark.py --output before.json
+    ... change some code ...
+    python benchmark.py --output after.json --compare before.json
+"""
+import argparse
+import io
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+
+import numpy as np
+
+from agents import GeneralQLearningAgent, QLearningAgent
+from fast_simulate import train_agent_fast
+from mazes.env import default_reward_map
+from mazes.maze import KeyMaze
+from mazes.maze_constructors import get_first_example_maze, make_maze
+from simulate import run_single_simulation, train_agent
+
+
+def make_key_maze(maze):
+    """
+    The same maze with a key in the open cell furthest from the goal.
+    """
+    distances = np.where(maze.goal_distance >= 0, maze.goal_distance, -1)
+    key_y, key_x = np.unravel_index(np.argmax(distances), distances.shape)
+    return KeyMaze(maze.maze, maze.start_position, maze.goal_position, [int(key_x), int(key_y)])
+
+
+def measure(work):
+    """
+    Run work() once to time it and once more to find its peak memory.
+    work() returns how many steps and episodes it did.
+    """
+    start = time.perf_counter()
+    steps, episodes = work()
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    work()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "seconds": seconds,
+        "steps": steps,
+        "episodes": episodes,
+        "steps_per_sec": steps / seconds,
+        "episodes_per_sec": episodes / seconds if episodes else None,
+        "peak_memory_bytes": peak_memory,
+    }
+
+
+def interact_benchmark(maze, num_steps):
+    actions = maze.get_actions()
+
+    def work():
+        np.random.seed(0)
+        chosen = [actions[ix] for ix in np.random.randint(len(actions), size=num_steps)]
+        maze.reset()
+        for action in chosen:
+            _, _, is_done = maze.interact(action)
+            if is_done:
+                maze.reset()
+        return num_steps, 0
+    return work
+
+
+def get_action_benchmark(maze, agent, num_steps):
+    state = maze.get_current_state()
+
+    def work():
+        np.random.seed(0)
+        for _ in range(num_steps):
+            agent.get_action(state)
+        return num_steps, 0
+    return work
+
+
+def update_benchmark(maze, agent, num_steps):
+    maze.reset()
+    state = maze.get_current_state()
+    next_state, _, _ = maze.interact(maze.get_actions()[0])
+    maze.reset()
+    action = maze.get_actions()[0]
+
+    def work():
+        for _ in range(num_steps):
+            agent.update_q_table(state, action, next_state, -1)
+        return num_steps, 0
+    return work
+
+
+def simulation_benchmark(maze, agent, max_steps):
+    def work():
+        np.random.seed(0)
+        _, episode_step, _ = run_single_simulation(agent, maze, reward_map=default_reward_map, max_steps=max_steps, verbose=False)
+        return episode_step, 1
+    return work
+
+
+def train_benchmark(maze, make_agent, max_steps, fast=False):
+    def work():
+        np.random.seed(0)
+        agent = make_agent()
+        if fast:
+            _, episode_steps = train_agent_fast(agent, maze, default_reward_map, max_steps=max_steps)
+            return int(episode_steps.sum()), len(episode_steps)
+        metrics = train_agent(agent, maze, default_reward_map, callbacks=[], max_steps=max_steps)
+        return sum(metrics.episode_steps), metrics.num_episodes()
+    return work
+
+
+def run_benchmarks(sizes, num_steps=20000, num_episodes=5, max_steps=20000):
+    """
+    Run every benchmark on every maze size and return a list of results.
+    """
+    # Compile the numba training loop (if numba is installed) first so compiling isn't counted
+    warm_up = get_first_example_maze()
+    train_agent_fast(QLearningAgent(warm_up, warm_up.get_actions(), num_episodes=1), warm_up, default_reward_map)
+
+    results = []
+    for size in sizes:
+        maze = make_maze(size)
+        key_maze = make_key_maze(maze)
+        actions = maze.get_actions()
+
+        def q_agent():
+            return QLearningAgent(maze, actions, num_episodes=num_episodes)
+
+        def general_agent():
+            return GeneralQLearningAgent(maze.get_actions, num_episodes=num_episodes)
+
+        benchmarks = {
+            "Maze.interact": interact_benchmark(maze, num_steps),
+            "KeyMaze.interact": interact_benchmark(key_maze, num_steps),
+            "QLearningAgent.get_action": get_action_benchmark(maze, q_agent(), num_steps),
+            "QLearningAgent.update_q_table": update_benchmark(maze, q_agent(), num_steps),
+            "GeneralQLearningAgent.get_action": get_action_benchmark(maze, general_agent(), num_steps),
+            "GeneralQLearningAgent.update_q_table": update_benchmark(maze, general_agent(), num_steps),
+            "run_single_simulation": simulation_benchmark(maze, q_agent(), max_steps),
+            "train_agent": train_benchmark(maze, q_agent, max_steps),
+            "train_agent GeneralQLearningAgent": train_benchmark(maze, general_agent, max_steps),
+            "train_agent_fast": train_benchmark(maze, q_agent, max_steps, fast=True),
+        }
+        for name, work in benchmarks.items():
+            # KeyMaze prints when the key is picked up
+            with redirect_stdout(io.StringIO()):
+                result = measure(work)
+            result.update({"benchmark": name, "maze": str(size)})
+            results.append(result)
+            print(f"{name:40s} maze {str(size):8s} {result['steps_per_sec']:14,.0f} steps/sec  "
+                  f"{result['peak_memory_bytes'] / 1e6:8.2f} MB")
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous):
+    """
+    Print how the steps/sec of each benchmark changed since a previous run.
+    """
+    before = {(result["benchmark"], result["maze"]): result for result in previous["results"]}
+    print(f"\nCompared with {previous.get('commit')}:")
+    for result in results:
+        old = before.get((result["benchmark"], result["maze"]))
+        if old is not None:
+            ratio = result["steps_per_sec"] / old["steps_per_sec"]
+            print(f"{result['benchmark']:40s} maze {result['maze']:8s} {ratio:6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the mazes, agents and training.")
+    parser.add_argument("--sizes", nargs="+", default=["example", "10", "50", "100", "500"],
+                        help='Maze sizes, "example" is get_first_example_maze and a number is a prims_maze')
+    parser.add_argument("--steps", type=int, default=20000, help="Steps for the stepping/get_action/update benchmarks")
+    parser.add_argument("--episodes", type=int, default=5, help="Episodes for the training benchmarks")
+    parser.add_argument("--max-steps", type=int, default=20000, help="Most steps in one episode")
+    parser.add_argument("--output", default="benchmark.json", help="Where to save the results")
+    parser.add_argument("--compare", default=None, help="Results from an earlier run to compare with")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.steps, args.episodes, args.max_steps)
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "settings": {"steps": args.steps, "episodes": args.episodes, "max_steps": args.max_steps},
+        "results": results,
+    }
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+
+    if args.compare:
+        with open(args.compare) as previous:
+            compare(results, json.load(previous))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Saving a trained agent and picking up where it left off.
+
+A checkpoint is a folder holding:
+ - meta.json: the kind of agent, its settings (learning rate, exploration, ...), how many episodes
+   it has done, its actions and the state of numpy's random number generator
+ - the q-values:
+    - QLearningAgent (and PrioritizedSweepingAgent): q_table.npy, the whole array as it is in memory.
+      A PrioritizedSweepingAgent's memory of moves isn't saved, it is learned again as it goes.
+    - GeneralQLearningAgent and CompactQLearningAgent: states.json with every state seen, and
+      q_values.npz with one row of q-values per state plus which actions have a value
+
+read_checkpoint opens q_table.npy as a memory map, so looking at a saved table doesn't read all of
+it from disk. load_checkpoint copies it into the agent, so the agent never holds on to the file and
+saving to the same folder again is safe.
+
+Every file is written under a temporary name and then renamed over the old one, so a save that is
+interrupted leaves the previous checkpoint as it was.
+
+Because the agent's exploration rate comes from current_episode, loading a checkpoint and calling
+train_agent again carries on from the same point in the exploration schedule.
+
+    save_checkpoint(agent, "checkpoints/run1")
+    ...
+    agent = QLearningAgent(maze, maze.get_actions(), num_episodes=100)
+    load_checkpoint(agent, "checkpoints/run1")
+    train_agent(agent, maze, reward_map)  # Runs the remaining episodes
+"""
+import json
+import os
+
+import numpy as np
+
+from agents import CompactQLearningAgent, QLearningAgent
+from metrics import Callback
+
+
+hyperparameters = ["learning_rate", "discount_factor", "exploration_start", "exploration_end", "num_episodes"]
+
+
+def random_state_to_json(random_state):
+    name, keys, position, has_gauss, cached_gaussian = random_state.get_state()
+    return {"name": name, "keys": keys.tolist(), "position": int(position),
+            "has_gauss": int(has_gauss), "cached_gaussian": float(cached_gaussian)}
+
+
+def random_state_from_json(state):
+    return (state["name"], np.array(state["keys"], dtype=np.uint32), state["position"],
+            state["has_gauss"], state["cached_gaussian"])
+
+
+def state_to_json(state):
+    # States are made of tuples (see make_hashable), which JSON stores as lists
+    if isinstance(state, tuple):
+        return [state_to_json(item) for item in state]
+    if isinstance(state, np.generic):
+        return state.item()
+    return state
+
+
+def state_from_json(state):
+    if isinstance(state, list):
+        return tuple(state_from_json(item) for item in state)
+    return state
+
+
+def replace_file(path, write, mode="wb"):
+    """
+    Write a file through write(open_file) under a temporary name in the same folder, then rename it
+    to path. Renaming replaces the old file in one go, so path is always either the old or the new file.
+    """
+    temporary_path = path + ".tmp"
+    try:
+        with open(temporary_path, mode) as open_file:
+            write(open_file)
+        os.replace(temporary_path, path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+
+def save_checkpoint(agent, directory, random_state=None):
+    """
+    Save the agent to a checkpoint folder.
+
+    Args:
+        agent: A QLearningAgent, GeneralQLearningAgent or CompactQLearningAgent.
+        directory: The folder to save it in, made if it doesn't exist.
+        random_state: The np.random.RandomState the training uses. numpy's global one by default.
+    """
+    os.makedirs(directory, exist_ok=True)
+    random_state = random_state if random_state is not None else np.random
+    actions = agent.actions if isinstance(agent, (QLearningAgent, CompactQLearningAgent)) else list(agent.actions_func())
+    meta = {
+        "agent": type(agent).__name__,
+        "hyperparameters": {name: getattr(agent, name) for name in hyperparameters},
+        "current_episode": agent.current_episode,
+        "actions": list(actions),
+        "random_state": random_state_to_json(random_state),
+    }
+
+    if isinstance(agent, QLearningAgent):
+        replace_file(os.path.join(directory, "q_table.npy"), lambda q_table_file: np.save(q_table_file, agent.q_table))
+    else:
+        if isinstance(agent, CompactQLearningAgent):
+            states = list(agent.state_ids)
+            q_values = agent.q_table[:agent.num_states]
+            has_value = agent.has_value[:agent.num_states]
+        else:
+            # Turn the {state: {action: q-value}} dictionary into a row of q-values per state
+            states = list(agent.q_table)
+            action_ixs = {action: ix for ix, action in enumerate(actions)}
+            q_values = np.zeros((len(states), len(actions)))
+            has_value = np.zeros((len(states), len(actions)), dtype=bool)
+            for state_ix, state in enumerate(states):
+                for action, q_value in agent.q_table[state].items():
+                    q_values[state_ix, action_ixs[action]] = q_value
+                    has_value[state_ix, action_ixs[action]] = True
+        replace_file(os.path.join(directory, "states.json"),
+                     lambda states_file: json.dump([state_to_json(state) for state in states], states_file), mode="w")
+        replace_file(os.path.join(directory, "q_values.npz"),
+                     lambda values_file: np.savez(values_file, q_values=q_values, has_value=np.packbits(has_value, axis=1)))
+
+    # meta.json goes last, so a folder with one always has the q-values to go with it
+    replace_file(os.path.join(directory, "meta.json"), lambda meta_file: json.dump(meta, meta_file), mode="w")
+
+
+def read_checkpoint(directory):
+    """
+    Read a checkpoint's meta.json and its q-values without needing an agent.
+
+    Returns:
+        meta: The contents of meta.json
+        q_values: For a QLearningAgent the q_table as a (copy on write) memory map. For the others
+            a dictionary with "states", "q_values" and "has_value".
+    """
+    with open(os.path.join(directory, "meta.json")) as meta_file:
+        meta = json.load(meta_file)
+
+    # QLearningAgent and its subclasses save the dense q_table
+    q_table_path = os.path.join(directory, "q_table.npy")
+    if os.path.exists(q_table_path):
+        return meta, np.load(q_table_path, mmap_mode="c")
+
+    with open(os.path.join(directory, "states.json")) as states_file:
+        states = [state_from_json(state) for state in json.load(states_file)]
+    with np.load(os.path.join(directory, "q_values.npz")) as arrays:
+        q_values = arrays["q_values"]
+        has_value = np.unpackbits(arrays["has_value"], axis=1, count=len(meta["actions"])).astype(bool)
+    return meta, {"states": states, "q_values": q_values, "has_value": has_value}
+
+
+def load_checkpoint(agent, directory, restore_random_state=True, random_state=None):
+    """
+    Load a checkpoint into an agent of the same kind, ready to carry on training or be tested.
+
+    Args:
+        agent: An agent made the same way as the one that was saved.
+        directory: The checkpoint folder.
+        restore_random_state: Also put the random number generator back the way it was, so the
+            rest of the training goes exactly as it would have without stopping.
+        random_state: The np.random.RandomState to put back, the one given to save_checkpoint.
+            numpy's global one by default.
+
+    Returns:
+        The agent.
+    """
+    meta, saved = read_checkpoint(directory)
+    if meta["agent"] != type(agent).__name__:
+        raise ValueError(f"The checkpoint is for a {meta['agent']}, not a {type(agent).__name__}")
+
+    for name, value in meta["hyperparameters"].items():
+        setattr(agent, name, value)
+    agent.current_episode = meta["current_episode"]
+
+    if isinstance(agent, QLearningAgent):
+        if saved.shape != agent.q_table.shape:
+            raise ValueError(f"The checkpoint's q_table is {saved.shape}, the agent's is {agent.q_table.shape}")
+        # Copy it out of the memory map, saving to this folder again would pull the file out from under it
+        agent.q_table[...] = saved
+    elif isinstance(agent, CompactQLearningAgent):
+        agent.state_ids = {state: state_id for state_id, state in enumerate(saved["states"])}
+        agent.num_states = len(saved["states"])
+        agent.q_table = np.zeros((max(len(saved["states"]), 1), agent.num_actions), dtype=agent.q_table.dtype)
+        agent.has_value = np.zeros(agent.q_table.shape, dtype=bool)
+        agent.q_table[:agent.num_states] = saved["q_values"]
+        agent.has_value[:agent.num_states] = saved["has_value"]
+        best_values = np.where(saved["has_value"], saved["q_values"], -np.inf).max(axis=1, initial=-np.inf)
+        agent.best_values = best_values.tolist()
+    else:
+        actions = meta["actions"]
+        agent.q_table = {}
+        for state, q_values, has_value in zip(saved["states"], saved["q_values"].tolist(), saved["has_value"]):
+            agent.q_table[state] = {actions[ix]: q_values[ix] for ix in np.flatnonzero(has_value)}
+
+    if restore_random_state:
+        random_state = random_state if random_state is not None else np.random
+        random_state.set_state(random_state_from_json(meta["random_state"]))
+    return agent
+
+
+class Checkpoint(Callback):
+    """
+    A train_agent callback that saves a checkpoint every few episodes, so a run that stops
+    part way through can be picked up again with load_checkpoint.
+    """
+
+    def __init__(self, directory, every=10):
+        self.directory = directory
+        self.every = every
+
+    def on_episode_end(self, agent, metrics):
+        if agent.current_episode % self.every == 0:
+            save_checkpoint(agent, self.directory)
+
+    def on_train_end(self, agent, metrics):
+        save_checkpoint(agent, self.directory)
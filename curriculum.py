@@ -0,0 +1,172 @@
+"""
+Training one agent on lots of mazes.
+
+Instead of learning a single maze, each training episode is played in a maze picked from a
+MazePool. The mazes are sorted by difficulty (the length of their shortest path) and training
+starts with only the easiest ones, adding harder ones as it goes. This is called a curriculum.
+
+The agent can either use one q_table for every maze (shared), which makes it learn what tends to
+work in any maze, or keep a separate q_table per maze. The separate tables live in one stacked
+array, q_tables[maze], and the agent is simply pointed at the right one before each episode.
+
+Making a pool builds every maze once. Pools are remembered, so asking for the same pool again
+(same maze maker, size, count and seed) hands back the mazes already built, and they can also be
+saved to and loaded from a .npz file.
+"""
+import math
+import os
+
+import numpy as np
+
+from metrics import TrainingMetrics, PrintProgress
+from mazes.basic_maze import Maze
+from mazes.maze_constructors import prims_mazes
+from simulate import run_single_simulation
+
+
+pool_cache = {}  # (maze maker, size, count, seed) -> MazePool
+
+
+class MazePool:
+
+    def __init__(self, mazes):
+        self.mazes = list(mazes)
+        shapes = {maze.maze.shape for maze in self.mazes}
+        if len(shapes) != 1:
+            raise ValueError(f"Every maze in a pool must be the same size, got {sorted(shapes)}")
+        # Difficulty is the fewest steps from start to goal, easiest first in order
+        self.difficulty = np.array([maze.optimal_path_length() for maze in self.mazes])
+        self.order = np.argsort(self.difficulty, kind="stable")
+
+    def __len__(self):
+        return len(self.mazes)
+
+    def __getitem__(self, ix):
+        return self.mazes[ix]
+
+    def stacked_q_tables(self, num_actions):
+        """
+        A zeroed q_table for every maze in one array, q_tables[maze, x, y, action].
+        """
+        maze = self.mazes[0]
+        return np.zeros((len(self.mazes), maze.maze_width, maze.maze_height, num_actions))
+
+    def save(self, path):
+        np.savez_compressed(path,
+                            grids=np.stack([maze.maze for maze in self.mazes]),
+                            start_positions=np.array([maze.start_position for maze in self.mazes]),
+                            goal_positions=np.array([maze.goal_position for maze in self.mazes]))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            return cls(Maze(grid, tuple(start.tolist()), tuple(goal.tolist()))
+                       for grid, start, goal in zip(arrays["grids"], arrays["start_positions"], arrays["goal_positions"]))
+
+
+def make_pool(size, count, seed=0, maze_maker=prims_mazes, cache_file=None):
+    """
+    Make (or fetch) a pool of count mazes.
+
+    Args:
+        size: Size of each maze.
+        count: How many mazes.
+        seed: Seed for the mazes, the same seed always gives the same pool.
+        maze_maker: Makes the mazes, called as maze_maker(size, count, seed), like prims_mazes or random_mazes.
+        cache_file: A .npz file to load the pool from, or to save it to if it doesn't exist yet.
+
+    Returns:
+        A MazePool
+    """
+    key = (maze_maker.__name__, size, count, seed)
+    if key not in pool_cache:
+        if cache_file is not None and os.path.exists(cache_file):
+            pool_cache[key] = MazePool.load(cache_file)
+        else:
+            pool_cache[key] = MazePool(maze_maker(size, count, seed))
+            if cache_file is not None:
+                pool_cache[key].save(cache_file)
+    return pool_cache[key]
+
+
+class Curriculum:
+    """
+    Picks the maze for each episode: at first from the easiest start_fraction of the pool, growing
+    steadily until every maze can be picked for the last episodes.
+    """
+
+    def __init__(self, pool, start_fraction=0.25, random_state=None):
+        self.pool = pool
+        self.start_fraction = start_fraction
+        # np.random.mtrand._rand is the generator behind np.random.seed(), so seeding that makes runs repeat
+        self.random_state = random_state if random_state is not None else np.random.mtrand._rand
+
+    def available(self, progress):
+        """
+        How many of the easiest mazes can be picked when progress (0 to 1) of the training is done.
+        """
+        fraction = self.start_fraction + (1 - self.start_fraction) * progress
+        return min(len(self.pool), max(1, math.ceil(fraction * len(self.pool))))
+
+    def next_maze(self, progress):
+        """
+        The index in the pool of the maze for the next episode.
+        """
+        return int(self.pool.order[self.random_state.randint(self.available(progress))])
+
+
+def train_curriculum(agent,
+                     pool,
+                     reward_map,
+                     shared=True,
+                     curriculum=None,
+                     callbacks=None,
+                     max_steps=500000):
+    """
+    Train a QLearningAgent on a pool of mazes.
+
+    Args:
+        agent: A QLearningAgent made for any maze of the pool's size.
+        pool: The MazePool to train on.
+        reward_map: Reward for each reward signal, e.g. {"wall": -10, "step": -1, "goal": 100}.
+        shared: Use the agent's q_table for every maze. If False each maze gets its own q_table, and
+            afterwards the agent is left pointing at the q_table of the last maze it played.
+        curriculum: Decides which maze each episode is in. Curriculum(pool) by default.
+        callbacks: Told about every episode as it finishes, see metrics.py. Progress is printed by default.
+        max_steps: The most steps allowed in a single episode. The agent only sees its position, so with
+            a shared q_table a move that is good in one maze can walk into a wall over and over in
+            another. A smaller max_steps keeps those episodes short.
+
+    Returns:
+        metrics: A TrainingMetrics with the reward, steps and wall hits of every episode
+        maze_ixs: Which maze of the pool each episode was in
+        q_tables: The stacked q_tables, q_tables[maze], or None when shared
+    """
+    if callbacks is None:
+        callbacks = [PrintProgress()]
+    if curriculum is None:
+        curriculum = Curriculum(pool)
+
+    q_tables = None if shared else pool.stacked_q_tables(agent.num_actions)
+    metrics = TrainingMetrics()
+    maze_ixs = []
+    stats = {}
+
+    while not agent.terminate():
+        maze_ix = curriculum.next_maze(agent.current_episode / agent.num_episodes)
+        maze = pool[maze_ix]
+        if q_tables is not None:
+            agent.q_table = q_tables[maze_ix]  # A view, so the agent's updates land in the stacked array
+        episode_reward, episode_step, _ = run_single_simulation(agent, maze, train=True, reward_map=reward_map, max_steps=max_steps,
+                                                                verbose=False, stats=stats, max_path_length=0)
+        metrics.record_episode(episode_reward, episode_step, stats["wall_hits"])
+        maze_ixs.append(maze_ix)
+        agent.new_episode()
+
+        for callback in callbacks:
+            callback.on_episode_end(agent, metrics)
+
+    for callback in callbacks:
+        callback.on_train_end(agent, metrics)
+
+    return metrics, maze_ixs, q_tables
@@ -0,0 +1,350 @@
+"""
+Answering questions about trained agents for lots of clients at once.
+
+The server loads saved QLearningAgent checkpoints (see checkpoints.py) once, and for each one
+works out its greedy policy up front: the best action of every state, in a single array. Clients
+send one JSON request per line and get one JSON response per line back:
+
+    {"id": 1, "op": "best_action", "checkpoint": "run1", "position": [3, 4]}
+    -> {"id": 1, "action": "down"}
+    {"id": 2, "op": "best_action", "checkpoint": "run1", "states": [0, 17, 42]}
+    -> {"id": 2, "actions": ["down", "right", "up"]}
+    {"id": 3, "op": "rollout", "checkpoint": "run1"}
+    -> {"id": 3, "path": [[0, 0], [0, 1], ...], "steps": 58, "reward": 43, "reached_goal": true}
+    {"id": 4, "op": "stats"}
+    -> {"id": 4, "requests": 3, "latency_ms": {"p50": ..., "p90": ..., "p99": ..., "max": ...}}
+
+Requests that arrive close together are answered together: all the best_action requests for a
+checkpoint in a batch are looked up with one numpy index, and a greedy rollout always goes the
+same way so it is only worked out once per checkpoint.
+
+From the command line, talking over stdin/stdout:
+    python eval_server.py --checkpoint run1=checkpoints/run1 --maze 50
+with a maze saved with Maze.save:
+    python eval_server.py --checkpoint run1=checkpoints/run1 --maze-dir mazes/run1
+or over TCP:
+    python eval_server.py --checkpoint run1=checkpoints/run1 --maze 50 --port 8765
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from contextlib import redirect_stdout
+
+import numpy as np
+
+# checkpoints.py imports agents.py, which prints a message that mustn't end up in the responses on stdout
+with redirect_stdout(sys.stderr):
+    from checkpoints import read_checkpoint
+from fast_simulate import reward_table
+from mazes.env import GOAL, WALL, default_reward_map
+from mazes.maze_constructors import load_maze, make_maze
+
+
+def integers(value, ndim, message):
+    """
+    value from a request as an int64 array with ndim dimensions, or a ValueError with message if it isn't one.
+    """
+    array = np.asarray(value)
+    # An empty list comes out as floats, anything else has to be made of ints (not bools, floats or strings)
+    if array.ndim != ndim or (array.size and array.dtype.kind not in "iu"):
+        raise ValueError(message)
+    return array.astype(np.int64)
+
+
+class PolicyCache:
+    """
+    The greedy policy of every loaded checkpoint, and its rollout from the start once it has been asked for.
+    """
+
+    def __init__(self, maze, reward_map=None):
+        self.maze = maze
+        self.rewards = reward_table(reward_map if reward_map is not None else default_reward_map)
+        self.best_actions = {}  # checkpoint name -> best action index of every state
+        self.actions = {}       # checkpoint name -> action names
+        self.rollouts = {}      # checkpoint name -> the whole greedy rollout, see full_rollout
+
+    def load(self, name, directory):
+        meta, q_table = read_checkpoint(directory)
+        if not isinstance(q_table, np.ndarray):
+            raise ValueError(f"Only QLearningAgent checkpoints can be served, {name} is a {meta['agent']}")
+        # q_table[x, y, action], or q_table[layer, x, y, action] for a StateQLearningAgent
+        width, height = q_table.shape[-3:-1]
+        if (width, height) != (self.maze.maze_width, self.maze.maze_height):
+            raise ValueError(f"{name} was trained on a {width}x{height} maze, not this one")
+        q_rows = q_table.reshape(-1, q_table.shape[-1])
+        # A KeyMaze has twice as many states as positions, and a position only q_table gives both halves the same action
+        self.best_actions[name] = np.argmax(q_rows, axis=1)[np.arange(self.maze.num_states) % len(q_rows)].astype(np.int8)
+        self.actions[name] = meta["actions"]
+
+    def state_ids(self, request):
+        """
+        The state ids a best_action request asks about, given as "states", "state" or "position" (and "has_key").
+        """
+        if "states" in request:
+            state_ids = integers(request["states"], 1, "states must be a list of integer state ids")
+        elif "state" in request:
+            state_ids = integers(request["state"], 0, "state must be an integer state id").reshape(1)
+        else:
+            position = integers(request["position"], 1, "position must be two integers [x, y]")
+            if len(position) != 2:
+                raise ValueError("position must be two integers [x, y]")
+            x, y = position.tolist()
+            if not (0 <= x < self.maze.maze_width and 0 <= y < self.maze.maze_height):
+                raise ValueError(f"Position {[x, y]} is outside the maze")
+            state_ids = np.asarray([self.maze.state_index([x, y]) + self.maze.num_positions * bool(request.get("has_key", False))])
+        if state_ids.size and (state_ids.min() < 0 or state_ids.max() >= self.maze.num_states):
+            raise ValueError("State id out of range")
+        return state_ids
+
+    def full_rollout(self, name):
+        """
+        Follow the greedy policy from the start until the goal, for at most num_states steps (a greedy
+        policy that takes longer than that is going round in circles). Worked out once per checkpoint.
+
+        Returns the path, the total reward after each step, how long the path is after each step and
+        whether the goal was reached.
+        """
+        if name not in self.rollouts:
+            maze = self.maze
+            best_actions = self.best_actions[name]
+            state = maze.state_index(maze.start_position)
+            path = [maze.position_from_index(state)]
+            total_rewards = []
+            path_lengths = []
+            total_reward = 0.0
+            reached_goal = False
+            for _ in range(maze.num_states):
+                action = best_actions[state]
+                reward_code = maze.reward_code[state, action]
+                total_reward += self.rewards[reward_code]
+                state = int(maze.next_state[state, action])
+                if reward_code != WALL:
+                    path.append(maze.position_from_index(state))
+                total_rewards.append(float(total_reward))
+                path_lengths.append(len(path))
+                if reward_code == GOAL:
+                    reached_goal = True
+                    break
+            self.rollouts[name] = (path, total_rewards, path_lengths, reached_goal)
+        return self.rollouts[name]
+
+    def rollout(self, name, max_steps=10000):
+        """
+        The greedy rollout from the start until the goal, cut short after max_steps (which is never more than num_states).
+        """
+        max_steps = min(max(int(max_steps), 0), self.maze.num_states)
+        path, total_rewards, path_lengths, reached_goal = self.full_rollout(name)
+        steps = min(max_steps, len(total_rewards))
+        if steps == 0:
+            return {"path": path[:1], "steps": 0, "reward": 0.0, "reached_goal": False}
+        path = path[:path_lengths[steps - 1]]
+        return {"path": path, "steps": len(path) - 1, "reward": total_rewards[steps - 1],
+                "reached_goal": reached_goal and steps == len(total_rewards)}
+
+
+class LatencyTracker:
+    """
+    How long every request took, from arriving to being answered.
+    """
+
+    def __init__(self):
+        self.latencies = []
+
+    def record(self, seconds):
+        self.latencies.append(seconds)
+
+    def percentiles(self):
+        if not self.latencies:
+            return {}
+        milliseconds = 1e3 * np.array(self.latencies)
+        p50, p90, p99 = np.percentile(milliseconds, [50, 90, 99])
+        return {"p50": float(p50), "p90": float(p90), "p99": float(p99), "max": float(milliseconds.max())}
+
+
+class EvalServer:
+
+    def __init__(self, policies, batch_size=256, batch_window=0.001):
+        """
+        Args:
+            policies: The PolicyCache to answer from.
+            batch_size: Most requests answered together.
+            batch_window: Seconds to wait for more requests to join a batch.
+        """
+        self.policies = policies
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.latency = LatencyTracker()
+        self.queue = None
+
+    async def submit(self, request):
+        """
+        Queue a request and wait for its response.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((request, future, time.perf_counter()))
+        return await future
+
+    async def run_batches(self):
+        while True:
+            batch = [await self.queue.get()]
+            deadline = time.perf_counter() + self.batch_window
+            while len(batch) < self.batch_size:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                self.answer(batch)
+            except Exception as error:
+                # Something no request check caught: only this batch gets an error, the server keeps going
+                for request, future, _ in batch:
+                    if not future.done():
+                        response = {"error": f"{type(error).__name__}: {error}"}
+                        if isinstance(request, dict) and "id" in request:
+                            response["id"] = request["id"]
+                        future.set_result(response)
+
+    def answer(self, batch):
+        responses = {}
+        # Look up every best_action request for the same checkpoint with one index
+        lookups = {}
+        for ix, (request, _, _) in enumerate(batch):
+            try:
+                op = request.get("op")
+                if op == "best_action":
+                    if request["checkpoint"] not in self.policies.best_actions:
+                        raise KeyError(f"Unknown checkpoint {request['checkpoint']!r}")
+                    state_ids = self.policies.state_ids(request)
+                    lookups.setdefault(request["checkpoint"], []).append((ix, state_ids))
+                elif op == "rollout":
+                    if request["checkpoint"] not in self.policies.best_actions:
+                        raise KeyError(f"Unknown checkpoint {request['checkpoint']!r}")
+                    responses[ix] = self.policies.rollout(request["checkpoint"], request.get("max_steps", 10000))
+                elif op == "stats":
+                    responses[ix] = {"requests": len(self.latency.latencies), "latency_ms": self.latency.percentiles()}
+                else:
+                    responses[ix] = {"error": f"Unknown op {op!r}"}
+            except (KeyError, TypeError, ValueError) as error:
+                responses[ix] = {"error": f"{type(error).__name__}: {error}"}
+
+        for name, requests in lookups.items():
+            actions = self.policies.actions[name]
+            best = self.policies.best_actions[name][np.concatenate([state_ids for _, state_ids in requests])].tolist()
+            offset = 0
+            for ix, state_ids in requests:
+                chosen = [actions[action] for action in best[offset:offset + len(state_ids)]]
+                responses[ix] = {"actions": chosen} if "states" in batch[ix][0] else {"action": chosen[0]}
+                offset += len(state_ids)
+
+        now = time.perf_counter()
+        for ix, (request, future, start) in enumerate(batch):
+            response = responses[ix]
+            if "id" in request:
+                response["id"] = request["id"]
+            self.latency.record(now - start)
+            if not future.done():
+                future.set_result(response)
+
+    async def handle_lines(self, read_line, write_line):
+        """
+        Answer JSON requests, one per line, until there are no more. Each request is handled on its
+        own, so a client can send many without waiting and they get batched together.
+        """
+        pending = set()
+
+        async def reply(line):
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError as error:
+                response = {"error": f"Bad JSON: {error}"}
+            else:
+                response = await self.submit(request) if isinstance(request, dict) else {"error": "A request must be a JSON object"}
+            await write_line(json.dumps(response))
+
+        while True:
+            line = await read_line()
+            if not line:
+                break
+            if line.strip():
+                task = asyncio.create_task(reply(line))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.gather(*pending)
+
+    async def serve_stdio(self):
+        self.queue = asyncio.Queue()
+        batcher = asyncio.create_task(self.run_batches())
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+
+        async def write_line(text):
+            sys.stdout.write(text + "\n")
+            sys.stdout.flush()
+
+        await self.handle_lines(reader.readline, write_line)
+        batcher.cancel()
+
+    async def serve_tcp(self, host="127.0.0.1", port=8765):
+        self.queue = asyncio.Queue()
+        batcher = asyncio.create_task(self.run_batches())
+
+        async def client(reader, writer):
+            async def write_line(text):
+                writer.write(text.encode() + b"\n")
+                await writer.drain()
+            try:
+                await self.handle_lines(reader.readline, write_line)
+            finally:
+                writer.close()
+
+        server = await asyncio.start_server(client, host, port)
+        print(f"Serving on {host}:{port}", file=sys.stderr)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the greedy policies of saved agents.")
+    parser.add_argument("--checkpoint", action="append", required=True, metavar="NAME=FOLDER",
+                        help="A checkpoint to serve, can be given more than once")
+    parser.add_argument("--maze", default="example", help='The maze the agents were trained on: "example" or a prims_maze size')
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the prims_maze given with --maze")
+    parser.add_argument("--maze-dir", default=None, help="A folder with a maze saved with Maze.save, used instead of --maze")
+    parser.add_argument("--port", type=int, default=None, help="Serve over TCP on this port instead of stdin/stdout")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--batch-window", type=float, default=0.001, help="Seconds to wait for a batch to fill up")
+    args = parser.parse_args()
+
+    maze = load_maze(args.maze_dir) if args.maze_dir is not None else make_maze(args.maze, args.seed)
+    policies = PolicyCache(maze)
+    for checkpoint in args.checkpoint:
+        name, directory = checkpoint.split("=", 1)
+        policies.load(name, directory)
+
+    server = EvalServer(policies, args.batch_size, args.batch_window)
+    try:
+        if args.port is None:
+            asyncio.run(server.serve_stdio())
+        else:
+            asyncio.run(server.serve_tcp(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    print(f"latency (ms): {server.latency.percentiles()}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,419 @@
+"""
+A faster way to train a QLearningAgent.
+
+train_agent in simulate.py is written to be easy to read: every step builds a state dictionary,
+looks actions and rewards up by name and calls back into the agent. That is great for learning how
+Q-learning works, but almost all of the time goes into that bookkeeping rather than the learning.
+
+train_agent_fast does exactly the same learning with everything kept as integers:
+ - states are the integer ids from Maze.state_index and moves come from the maze's next_state / reward_code tables
+ - each state's q-values are a short python list that also remembers its best value
+ - actions are indexes into maze.get_actions()
+ - rewards are looked up from a small array indexed by reward code
+ - the exploration rate for every episode is worked out up front
+ - random numbers are drawn in big blocks
+
+The random numbers are drawn from the same numpy random generator, and used in the same order, as
+QLearningAgent.get_action uses them. So for the same seed it learns exactly the same q_table as train_agent.
+
+If numba is installed the training loop is compiled to machine code (run_episodes_numba), which is
+much faster again. Without numba the plain python loop (run_episodes_python) is used. Both give
+exactly the same results.
+
+A float32 or float16 q_table is trained the way numpy does the sums in QLearningAgent.update_q_table:
+every step of the update is rounded to the table's type. numba has no float16, so a float16 table is
+trained in a float32 copy where every result is rounded to the nearest float16 (round_to_half), which
+is exactly how numpy works out float16 sums too.
+"""
+import math
+
+import numpy as np
+
+from mazes.env import REWARD_SIGNALS, GOAL
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def reward_table(reward_map):
+    """
+    Turn a reward_map like {"wall": -10, "step": -1, "goal": 100} into an array indexed by reward code.
+    Signals that are not in the map are worth 0, same as run_single_simulation.
+    """
+    return np.array([reward_map.get(signal, 0.0) for signal in REWARD_SIGNALS], dtype=float)
+
+
+def exploration_schedule(agent):
+    """
+    The exploration rate for every episode from the agent's current episode to the end of training.
+    Uses the same formula as agent.get_exploration_rate().
+    """
+    return [agent.exploration_start * (agent.exploration_end / agent.exploration_start) ** (episode / agent.num_episodes)
+            for episode in range(agent.current_episode, agent.num_episodes)]
+
+
+class RandomWords:
+    """
+    Hands out blocks of the raw 32 bit numbers behind a numpy RandomState.
+
+    np.random.rand() is made from two of these numbers and np.random.randint(n) from one (or more, if it
+    has to retry), so working from the raw numbers lets us reproduce get_action's random choices exactly
+    without calling into numpy once per step.
+    """
+
+    def __init__(self, random_state=None, block_size=1 << 16):
+        # np.random.mtrand._rand is the generator behind np.random.rand(), np.random.seed(), ...
+        self.random_state = np.random.mtrand._rand if random_state is None else random_state
+        self.block_size = block_size
+        self.start_state = self.random_state.get_state()
+        self.words_used = 0
+
+    def next_block(self, leftover=None):
+        """
+        Return a fresh block of numbers, with any unused numbers from the last block at the front.
+        """
+        words = self.random_state.randint(0, 2 ** 32, size=self.block_size, dtype=np.uint32).astype(np.int64)
+        if leftover is not None and len(leftover):
+            words = np.concatenate([leftover, words])
+        return words
+
+    def finish(self):
+        """
+        Leave the RandomState exactly where it would be if the numbers had been drawn one at a time.
+        """
+        self.random_state.set_state(self.start_state)
+        remaining = self.words_used
+        while remaining > 0:
+            count = min(remaining, 1 << 20)
+            self.random_state.randint(0, 2 ** 32, size=count, dtype=np.uint32)
+            remaining -= count
+
+
+def uniforms_from_words(words):
+    """
+    uniforms[k] is the number np.random.rand() would give using words k and k + 1.
+    """
+    return ((words[:-1] >> 5) * 67108864.0 + (words[1:] >> 6)) / 9007199254740992.0
+
+
+def action_mask(num_actions):
+    """
+    np.random.randint(num_actions) keeps the low bits of a random word and retries if they are too big.
+    This is the mask it uses for those low bits.
+    """
+    mask = num_actions - 1
+    for shift in (1, 2, 4, 8, 16):
+        mask |= mask >> shift
+    return mask
+
+
+def round_to_half(value):
+    """
+    The float16 nearest to value (ties to even, like numpy), as a float32.
+    """
+    magnitude = abs(float(value))
+    if magnitude == 0.0 or magnitude != magnitude or magnitude == math.inf:
+        return np.float32(value)
+    if magnitude < 6.103515625e-05:
+        # Below 2**-14 float16 values are evenly spaced 2**-24 apart
+        quantum = 5.960464477539063e-08
+    else:
+        # Otherwise there are 2**10 of them between each power of two
+        quantum = math.ldexp(1.0, math.frexp(magnitude)[1] - 11)
+    rounded = np.rint(magnitude / quantum) * quantum
+    if rounded > 65504.0:
+        rounded = math.inf
+    return np.float32(rounded if value > 0 else -rounded)
+
+
+def run_episodes_python(state_q_values, transitions, rewards,
+                        words, uniforms, mask, exploration_rates,
+                        learning_rate, discount_factor, max_steps, start_state,
+                        progress, episode_rewards, episode_steps):
+    """
+    The training loop itself, written with plain python lists.
+
+    state_q_values[state] is the list of q-values the agent has for that state, with the largest of
+    them kept up to date in an extra slot at the end so we rarely have to search for it.
+    transitions[state][action] is the (next state, reward code) pair from the maze's tables.
+    Several states can share one list of q-values (a QLearningAgent on a KeyMaze only knows positions).
+    For a float32 or float16 table the q-values are numpy scalars of that type, so the sums are
+    rounded the same way as in QLearningAgent.update_q_table.
+
+    progress is [episode, state, step, episode_reward] and is picked up and handed back so the loop can
+    stop when it runs out of random numbers and carry on with the next block.
+
+    Returns the number of random words used.
+    """
+    episode, state, step, episode_reward = progress
+    num_actions = len(transitions[0])
+    num_words = len(words)
+    last_word = num_words - 3  # A random action choice needs at least three random words
+    num_episodes = len(exploration_rates)
+    goal = GOAL
+    k = 0
+
+    while episode < num_episodes:
+        exploration_rate = exploration_rates[episode]
+        while step < max_steps:
+            # Choose an action, the same way QLearningAgent.get_action does
+            if k > last_word:
+                progress[:] = [episode, state, step, episode_reward]
+                return k
+            q_values = state_q_values[state]
+            if uniforms[k] < exploration_rate:
+                action = words[k + 2] & mask
+                j = k + 3
+                # np.random.randint tries again if the number is too big (never happens when num_actions is a power of two)
+                while action >= num_actions:
+                    if j >= num_words:
+                        progress[:] = [episode, state, step, episode_reward]
+                        return k
+                    action = words[j] & mask
+                    j += 1
+                k = j
+            else:
+                k += 2
+                action = q_values.index(q_values[num_actions])  # First best action, same as np.argmax
+
+            # Take the step
+            next_state_idx, code = transitions[state][action]
+            reward = rewards[code]
+            episode_reward += reward
+            step += 1
+
+            # Q-value update, the same formula as QLearningAgent.update_q_table
+            current_q_value = q_values[action]
+            new_q_value = current_q_value + learning_rate * (reward + discount_factor * state_q_values[next_state_idx][num_actions] - current_q_value)
+            q_values[action] = new_q_value
+
+            # Keep the best value slot up to date
+            if new_q_value >= q_values[num_actions]:
+                q_values[num_actions] = new_q_value
+            elif current_q_value == q_values[num_actions]:
+                q_values[num_actions] = max(q_values[:num_actions])
+
+            state = next_state_idx
+            if code == goal:
+                break
+
+        episode_rewards[episode] = episode_reward
+        episode_steps[episode] = step
+        episode += 1
+        state = start_state
+        step = 0
+        episode_reward = 0.0
+
+    progress[:] = [episode, state, step, episode_reward]
+    return k
+
+
+def run_episodes_arrays(q_table, next_state, reward_code, rewards, q_rewards, constants, half,
+                        words, uniforms, mask, exploration_rates,
+                        max_steps, start_state,
+                        progress, episode_rewards, episode_steps):
+    """
+    The same training loop as run_episodes_python, written over numpy arrays so numba can compile it.
+
+    q_table is the agent's q_table as a (rows, num_actions) array and is updated in place.
+    next_state and reward_code are the maze's (num_states, num_actions) tables.
+    rewards (float64) add up the episode rewards, q_rewards are the same rewards in the q_table's type
+    for the update, and constants is [learning_rate, discount_factor] in the q_table's type, so every
+    sum in the update is done in that type. With half, every sum is also rounded to float16.
+    progress is a float array holding [episode, state, step, episode_reward].
+
+    Returns the number of random words used.
+    """
+    episode = int(progress[0])
+    state = int(progress[1])
+    step = int(progress[2])
+    episode_reward = progress[3]
+    num_rows, num_actions = q_table.shape
+    num_words = len(words)
+    last_word = num_words - 3
+    num_episodes = len(exploration_rates)
+    learning_rate = constants[0]
+    discount_factor = constants[1]
+    k = 0
+
+    while episode < num_episodes:
+        exploration_rate = exploration_rates[episode]
+        while step < max_steps:
+            # Choose an action, the same way QLearningAgent.get_action does
+            if k > last_word:
+                progress[0] = episode
+                progress[1] = state
+                progress[2] = step
+                progress[3] = episode_reward
+                return k
+            row = state % num_rows
+            if uniforms[k] < exploration_rate:
+                action = words[k + 2] & mask
+                j = k + 3
+                while action >= num_actions:
+                    if j >= num_words:
+                        progress[0] = episode
+                        progress[1] = state
+                        progress[2] = step
+                        progress[3] = episode_reward
+                        return k
+                    action = words[j] & mask
+                    j += 1
+                k = j
+            else:
+                k += 2
+                action = 0
+                for other in range(1, num_actions):
+                    if q_table[row, other] > q_table[row, action]:
+                        action = other
+
+            # Take the step
+            next_state_idx = next_state[state, action]
+            code = reward_code[state, action]
+            episode_reward += rewards[code]
+            step += 1
+
+            # Q-value update, the same formula as QLearningAgent.update_q_table, one sum at a time
+            next_row = next_state_idx % num_rows
+            best_next = q_table[next_row, 0]
+            for other in range(1, num_actions):
+                if q_table[next_row, other] > best_next:
+                    best_next = q_table[next_row, other]
+            current_q_value = q_table[row, action]
+            change = discount_factor * best_next
+            if half:
+                change = round_to_half(change)
+            change = q_rewards[code] + change
+            if half:
+                change = round_to_half(change)
+            change = change - current_q_value
+            if half:
+                change = round_to_half(change)
+            change = learning_rate * change
+            if half:
+                change = round_to_half(change)
+            new_q_value = current_q_value + change
+            if half:
+                new_q_value = round_to_half(new_q_value)
+            q_table[row, action] = new_q_value
+
+            state = next_state_idx
+            if code == GOAL:
+                break
+
+        episode_rewards[episode] = episode_reward
+        episode_steps[episode] = step
+        episode += 1
+        state = start_state
+        step = 0
+        episode_reward = 0.0
+
+    progress[0] = episode
+    progress[1] = state
+    progress[2] = step
+    progress[3] = episode_reward
+    return k
+
+
+if numba is not None:
+    round_to_half = numba.njit(cache=True)(round_to_half)
+    run_episodes_numba = numba.njit(cache=True)(run_episodes_arrays)
+else:
+    run_episodes_numba = None
+
+
+def train_agent_fast(agent,
+                     maze,
+                     reward_map,
+                     max_steps=500000,
+                     random_state=None,
+                     block_size=1 << 16,
+                     use_numba=None):
+    """
+    Train a QLearningAgent from its current episode to the end of training, same as train_agent but much faster.
+
+    Args:
+        agent: A QLearningAgent, its q_table is updated in place.
+        maze: The Maze (or KeyMaze) to train in.
+        reward_map: Reward for each reward signal, e.g. {"wall": -10, "step": -1, "goal": 100}.
+        max_steps: Most steps allowed in a single episode.
+        random_state: numpy RandomState to draw from, by default the one behind np.random.
+        block_size: How many random numbers to draw at a time.
+        use_numba: Use the compiled loop. By default it is used whenever numba is installed.
+
+    The result is exactly what train_agent gives, for float64, float32 and float16 q_tables.
+
+    Returns:
+        episode_rewards: Total reward for each episode
+        episode_steps: Number of steps taken in each episode
+    """
+    if list(agent.actions) != maze.get_actions():
+        raise ValueError("The agent's actions must be the maze's actions, in the same order")
+
+    if use_numba is None:
+        use_numba = run_episodes_numba is not None
+    if use_numba and run_episodes_numba is None:
+        raise ImportError("use_numba=True needs numba to be installed")
+
+    num_actions = agent.num_actions
+    exploration_rates = exploration_schedule(agent)
+    num_episodes = len(exploration_rates)
+    episode_rewards = np.zeros(num_episodes)
+    episode_steps = np.zeros(num_episodes, dtype=np.int64)
+    mask = action_mask(num_actions)
+    start_state = maze.state_index(maze.start_position)
+    random_words = RandomWords(random_state, block_size)
+
+    dtype = agent.q_table.dtype
+    half = dtype == np.float16
+    if use_numba:
+        # numba has no float16, so those tables are trained in a float32 copy (rounded to float16 as it goes)
+        q_table = agent.q_table.reshape(-1, num_actions)
+        if half:
+            q_table = q_table.astype(np.float32)
+        rewards = reward_table(reward_map)
+        # numpy turns the python numbers in the update into the table's type before using them
+        q_rewards = rewards.astype(dtype).astype(q_table.dtype)
+        constants = np.array([agent.learning_rate, agent.discount_factor]).astype(dtype).astype(q_table.dtype)
+        exploration_rates = np.array(exploration_rates)
+        progress = np.array([0, start_state, 0, 0.0])
+
+        def run_block(words):
+            return run_episodes_numba(q_table, maze.next_state, maze.reward_code, rewards, q_rewards, constants, half,
+                                      words, uniforms_from_words(words), mask, exploration_rates,
+                                      max_steps, start_state,
+                                      progress, episode_rewards, episode_steps)
+    else:
+        # One list of q-values per row of the q_table. The agent sees maze state ids modulo the number of
+        # rows, so a position only q_table on a KeyMaze gives both halves of the state space the same rows.
+        # A float32 or float16 table keeps numpy scalars, so the sums are rounded the way numpy rounds them.
+        table_rows = agent.q_table.reshape(-1, num_actions)
+        q_rows = [q_values + [max(q_values)] for q_values in (table_rows.tolist() if dtype == np.float64 else map(list, table_rows))]
+        state_q_values = [q_rows[state % len(q_rows)] for state in range(maze.num_states)]
+        transitions = [list(zip(next_states, codes)) for next_states, codes in zip(maze.next_state.tolist(), maze.reward_code.tolist())]
+        rewards = reward_table(reward_map).tolist()
+        progress = [0, start_state, 0, 0.0]
+
+        def run_block(words):
+            return run_episodes_python(state_q_values, transitions, rewards,
+                                       words.tolist(), uniforms_from_words(words).tolist(), mask, exploration_rates,
+                                       agent.learning_rate, agent.discount_factor, max_steps, start_state,
+                                       progress, episode_rewards, episode_steps)
+
+    # Keep running until every episode is done, topping up the random numbers whenever they run out
+    words = None
+    while progress[0] < num_episodes:
+        words = random_words.next_block(words)
+        used = run_block(words)
+        random_words.words_used += used
+        words = words[used:]
+    random_words.finish()
+
+    if not use_numba:
+        agent.q_table[...] = np.array([q_values[:num_actions] for q_values in q_rows], dtype=dtype).reshape(agent.q_table.shape)
+    elif half:
+        agent.q_table[...] = q_table.reshape(agent.q_table.shape)
+    agent.current_episode += num_episodes
+    return episode_rewards, episode_steps
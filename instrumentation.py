@@ -0,0 +1,115 @@
+"""
+Finding out where the time goes during training.
+
+Pass a Profiler to run_single_simulation or train_agent and it records:
+ - how long each part of every step takes: choosing the action, stepping the maze,
+   looking up the reward and updating the q-table
+ - for every episode: the number of steps, how long it took and how many times each
+   reward signal came up (wall hits, goal_locked, got_key, ...)
+
+Without a profiler nothing is timed or counted, so normal training runs at full speed.
+
+The results can be printed as a table with summary_table() or saved with write_trace() as a
+trace file that can be opened in chrome://tracing or https://ui.perfetto.dev.
+"""
+import json
+import time
+
+
+class Profiler:
+
+    phases = ["action", "step", "reward", "update"]
+
+    def __init__(self):
+        self.phase_seconds = dict.fromkeys(self.phases, 0.0)
+        self.phase_calls = dict.fromkeys(self.phases, 0)
+        self.episodes = []  # One dictionary of counts and timings per episode
+        self.signal_counts = {}
+        self.episode_start = None
+        self.episode_phase_seconds = None
+        self.last_time = None
+
+    def start_episode(self):
+        self.signal_counts = {}
+        self.episode_phase_seconds = dict.fromkeys(self.phases, 0.0)
+        self.episode_start = time.perf_counter()
+        self.last_time = self.episode_start
+
+    def lap(self, phase):
+        """
+        The given phase has just finished: add the time since the last lap to it.
+        """
+        now = time.perf_counter()
+        seconds = now - self.last_time
+        self.phase_seconds[phase] += seconds
+        self.phase_calls[phase] += 1
+        self.episode_phase_seconds[phase] += seconds
+        self.last_time = now
+
+    def count(self, reward_signal):
+        self.signal_counts[reward_signal] = self.signal_counts.get(reward_signal, 0) + 1
+
+    def end_episode(self, episode_step):
+        end = time.perf_counter()
+        self.episodes.append({
+            "episode": len(self.episodes),
+            "start": self.episode_start,
+            "seconds": end - self.episode_start,
+            "steps": episode_step,
+            "wall_hits": self.signal_counts.get("wall", 0),
+            "goal_locked": self.signal_counts.get("goal_locked", 0),
+            "signals": dict(self.signal_counts),
+            "phase_seconds": dict(self.episode_phase_seconds),
+        })
+
+    def total_seconds(self):
+        return sum(episode["seconds"] for episode in self.episodes)
+
+    def summary_table(self):
+        """
+        A table of where the time went and what happened, ready to print.
+        """
+        total = self.total_seconds()
+        lines = [f"{'phase':10s} {'calls':>12s} {'seconds':>10s} {'per call (us)':>14s} {'share':>7s}"]
+        for phase in self.phases:
+            calls = self.phase_calls[phase]
+            seconds = self.phase_seconds[phase]
+            per_call = 1e6 * seconds / calls if calls else 0.0
+            share = seconds / total if total else 0.0
+            lines.append(f"{phase:10s} {calls:12d} {seconds:10.3f} {per_call:14.2f} {share:7.1%}")
+        other = total - sum(self.phase_seconds.values())
+        lines.append(f"{'other':10s} {'':12s} {other:10.3f} {'':14s} {(other / total if total else 0.0):7.1%}")
+
+        steps = sum(episode["steps"] for episode in self.episodes)
+        wall_hits = sum(episode["wall_hits"] for episode in self.episodes)
+        goal_locked = sum(episode["goal_locked"] for episode in self.episodes)
+        lines.append("")
+        lines.append(f"episodes: {len(self.episodes)}, steps: {steps}, wall hits: {wall_hits}, goal locked: {goal_locked}")
+        if total:
+            lines.append(f"steps/sec: {steps / total:,.0f}")
+        return "\n".join(lines)
+
+    def write_trace(self, path):
+        """
+        Save a trace file in the Chrome trace event format, with one bar per episode and
+        a bar per phase inside it showing how much of the episode that phase took.
+        """
+        events = []
+        for episode in self.episodes:
+            start_us = 1e6 * episode["start"]
+            events.append({
+                "name": f"episode {episode['episode']}",
+                "ph": "X",
+                "ts": start_us,
+                "dur": 1e6 * episode["seconds"],
+                "pid": 0,
+                "tid": 0,
+                "args": {"steps": episode["steps"], **episode["signals"]},
+            })
+            # Phases are spread through the episode, so they are drawn back to back on their own row
+            offset_us = start_us
+            for phase, seconds in episode["phase_seconds"].items():
+                events.append({"name": phase, "ph": "X", "ts": offset_us, "dur": 1e6 * seconds, "pid": 0, "tid": 1})
+                offset_us += 1e6 * seconds
+        with open(path, "w") as trace_file:
+            json.dump({"traceEvents": events}, trace_file)
@@ -1,10 +1,26 @@
-from mazes.env import Environment
+from mazes.env import Environment, REWARD_SIGNALS, STEP, WALL, GOAL
+from mazes.search import distance_field
+from mazes.storage import PackedGrid, store_grid
 
 
-import matplotlib.pyplot as plt
+import json
+import os
+
 import numpy as np
 
 
+# How many positions _position_moves works on at a time
+chunk_positions = 1 << 18
+
+
+def figure_size(width, height, max_inches=12):
+    """
+    An inch per cell for small mazes, shrunk so the longest side is at most max_inches for big ones.
+    """
+    scale = min(1.0, max_inches / max(width, height))
+    return (width * scale, height * scale)
+
+
 class Maze(Environment):
     """
     This represents the maze and the current position within the maze.
@@ -15,17 +31,31 @@ class Maze(Environment):
      - interact(action) -> 
         try to take the given action, either moving in the desired direction or running into a wall 
         lets us know new position and whether we hit a wall / took a step / reached the goal
-    
-    
+
+    Because the maze never changes, every possible move is worked out once when the maze is built
+    and stored in two tables:
+     - next_state[state, action] -> the state we end up in
+     - reward_code[state, action] -> the reward code from mazes.env (STEP, WALL, GOAL)
+    A state is an integer id for a position, see state_index().
+
+    For very big mazes the grid can be stored compactly with grid_storage ("uint8", "bool" or "bits",
+    see mazes/storage.py), and save()/load() keep the grid and tables in files that are memory mapped.
+    The tables take 5 bytes for every position and action (a 4000x4000 maze needs 320MB for them),
+    so with build_tables=False they are left out and every step is worked out from the grid instead,
+    which is slower but needs nothing besides the grid and goal_distance. The array based code
+    (train_agent_fast, planning, replay) needs the tables.
     """
 
     def __init__(self,
                  maze_specification,
                  start_position,
-                 goal_position):
+                 goal_position,
+                 grid_storage=None,
+                 saved_tables=None,
+                 build_tables=True):
         
         # Initialize Maze object with the provided maze, start_position, and goal position
-        self.maze = maze_specification
+        self.maze = store_grid(maze_specification, grid_storage)
         self.maze_height = self.maze.shape[0] # Get the height of the maze (number of rows)
         self.maze_width = self.maze.shape[1]  # Get the width of the maze (number of columns)
         
@@ -33,9 +63,22 @@ class Maze(Environment):
         self.goal_position = goal_position      # Set the goal position in the maze as a tuple (x, y)
         self.current_position = start_position # Set the current position in the maze as a tuple (x, y)
         self.action_step_map = {"down": (0, 1), "up": (0, -1), "left": (-1, 0), "right": (1, 0)}
+        self.action_index = {action: ix for ix, action in enumerate(self.get_actions())}
+        # Tables that were worked out before (see load) don't need working out again
+        self.saved_tables = saved_tables
         # check that there is a path from start to end
         self.__validate_maze()
 
+        # Work out every move ahead of time
+        self.num_positions = self.maze_height * self.maze_width
+        if not build_tables:
+            self.next_state, self.reward_code = None, None
+        elif saved_tables is not None:
+            self.next_state, self.reward_code = saved_tables["next_state"], saved_tables["reward_code"]
+        else:
+            self.next_state, self.reward_code = self._build_transition_table()
+        self.num_states = self.next_state.shape[0] if self.next_state is not None else self.num_positions
+
     def reset(self):
         """
         Reset the envirnoment (the maze) by resetting the characters position back to the start_position.
@@ -61,8 +104,8 @@ class Maze(Environment):
         """
         Is the position we are going to a wall?
         """
-        return (next_position[0] < 0 or next_position[0] >= self.maze_height or
-            next_position[1] < 0 or next_position[1] >= self.maze_width or
+        return (next_position[0] < 0 or next_position[0] >= self.maze_width or
+            next_position[1] < 0 or next_position[1] >= self.maze_height or
             self.maze[next_position[1]][next_position[0]] == 1)
 
     def goal_check(self, next_position):
@@ -71,6 +114,54 @@ class Maze(Environment):
         """
         return next_position[0] == self.goal_position[0] and next_position[1] == self.goal_position[1]
 
+    def state_index(self, position):
+        """
+        Turn an (x, y) position into an integer state id.
+
+        The ids run down each column, so they line up with a q_table[x, y] array flattened to q_table[state].
+        """
+        return position[0] * self.maze_height + position[1]
+
+    def position_from_index(self, state_idx):
+        """
+        Turn an integer state id back into an [x, y] position.
+        """
+        x, y = divmod(state_idx % self.num_positions, self.maze_height)
+        return [x, y]
+
+    def get_state_index(self):
+        """
+        Return the integer state id of where we are now.
+        """
+        return self.state_index(self.current_position)
+
+    def step_index(self, state_idx, action_idx):
+        """
+        The fast path for taking a step, all in integers.
+
+        Args:
+            state_idx: Integer state id (see state_index).
+            action_idx: Index of the action in get_actions().
+
+        Returns:
+            next_state_idx: The state id we end up in
+            reward_code: The reward code (STEP, WALL, GOAL)
+            is_done: Whether the episode is complete (reached goal)
+        """
+        if self.next_state is None:
+            # No tables (build_tables=False), look at the grid
+            position = self.position_from_index(state_idx)
+            step_x, step_y = self.action_step_map[self.get_actions()[action_idx]]
+            next_position = [position[0] + step_x, position[1] + step_y]
+            if self.wall_check(next_position):
+                return state_idx, WALL, False
+            if self.goal_check(next_position):
+                return self.state_index(next_position), GOAL, True
+            return self.state_index(next_position), STEP, False
+
+        reward_code = int(self.reward_code[state_idx, action_idx])
+        return int(self.next_state[state_idx, action_idx]), reward_code, reward_code == GOAL
+
     def interact(self, action):
         """
         Interact with the maze environment by taking an action and returning the next state, reward, and whether the episode is done.
@@ -83,35 +174,70 @@ class Maze(Environment):
             reward: The reward received for taking the action 
             is_done: Whether the episode is complete (reached goal)
         """
-        action_step = self.action_step_map[action]
-        next_position = [self.current_position[0] + action_step[0], self.current_position[1] + action_step[1]]
-
-        # Check if the next state is out of bounds or hitting a wall
-        if self.wall_check(next_position):
-            reward_signal = "wall" # Wall penalty
-            is_done = False
-        # Check if the agent reached the goal
-        elif self.goal_check(next_position):
-            reward_signal = "goal" # Goal reward
-            self.current_position = next_position
-            is_done = True
-        # The agent takes a valid step but hasn't reached the goal yet
-        else:
-            reward_signal = "step" # Small penalty for each step
-            self.current_position = next_position
-            is_done = False
+        next_state_idx, reward_code, is_done = self.step_index(self.get_state_index(), self.action_index[action])
+
+        # When we hit a wall we stay where we are
+        if reward_code != WALL:
+            self.current_position = self.position_from_index(next_state_idx)
+
+        return {"position" : self.current_position}, REWARD_SIGNALS[reward_code], is_done
+
+    def _position_moves(self):
+        """
+        For every position and action work out where we would move to and whether we would hit a wall.
+
+        Returns two (num_positions, num_actions) arrays: the next position id and a wall hit flag.
+
+        The positions are done a few columns at a time with int32 numbers, so working them out takes
+        little memory besides the two arrays that are returned.
+        """
+        next_positions = np.empty((self.num_positions, len(self.action_index)), dtype=np.int32)
+        hit_wall = np.empty((self.num_positions, len(self.action_index)), dtype=bool)
+        columns_per_chunk = max(1, chunk_positions // self.maze_height)
+        for first_column in range(0, self.maze_width, columns_per_chunk):
+            columns = np.arange(first_column, min(first_column + columns_per_chunk, self.maze_width), dtype=np.int32)
+            x = np.repeat(columns, self.maze_height)
+            y = np.tile(np.arange(self.maze_height, dtype=np.int32), len(columns))
+            state_ids = x * self.maze_height + y
+            chunk = slice(state_ids[0], state_ids[-1] + 1)
+
+            for action, action_ix in self.action_index.items():
+                step_x, step_y = self.action_step_map[action]
+                next_x = x + step_x
+                next_y = y + step_y
+
+                # Out of bounds or running into a wall both count as a wall hit
+                in_bounds = (next_x >= 0) & (next_x < self.maze_width) & (next_y >= 0) & (next_y < self.maze_height)
+                wall = ~in_bounds
+                wall[in_bounds] = self.maze[next_y[in_bounds], next_x[in_bounds]] == 1
+
+                next_positions[chunk, action_ix] = np.where(wall, state_ids, next_x * self.maze_height + next_y)
+                hit_wall[chunk, action_ix] = wall
+        return next_positions, hit_wall
+
+    def _build_transition_table(self):
+        """
+        Build the next_state and reward_code tables.
+        """
+        next_state, hit_wall = self._position_moves()
 
-        return {"position" : self.current_position}, reward_signal, is_done
+        reward_code = np.full(next_state.shape, STEP, dtype=np.int8)
+        reward_code[hit_wall] = WALL
+        # Only the moves from next to the goal go onto it
+        states, actions = np.nonzero(next_state == self.state_index(self.goal_position))
+        onto_goal = ~hit_wall[states, actions]
+        reward_code[states[onto_goal], actions[onto_goal]] = GOAL
+        return next_state, reward_code
 
 
     def __validate_maze(self):
         # Validate the maze is a 2D array
-        if not isinstance(self.maze, np.ndarray) or self.maze.ndim != 2:
+        if not isinstance(self.maze, (np.ndarray, PackedGrid)) or self.maze.ndim != 2:
             raise ValueError("Maze must be a 2D array")
         # Validate the start and goal positions are within the maze bounds
-        if not (0 <= self.start_position[0] < self.maze_height and 0 <= self.start_position[1] < self.maze_width):
+        if not (0 <= self.start_position[0] < self.maze_width and 0 <= self.start_position[1] < self.maze_height):
             raise ValueError("Start position is out of bounds")
-        if not (0 <= self.goal_position[0] < self.maze_height and 0 <= self.goal_position[1] < self.maze_width):
+        if not (0 <= self.goal_position[0] < self.maze_width and 0 <= self.goal_position[1] < self.maze_height):
             raise ValueError("Goal position is out of bounds")
         # Validate the start and goal positions are not on a wall
         if self.maze[self.start_position[1]][self.start_position[0]] == 1:
@@ -123,44 +249,105 @@ class Maze(Environment):
             raise ValueError("Maze does not have a path from start to goal")
 
     def __has_path(self, start, goal):
-        # Implement a pathfinding algorithm to check if there is a path from start to goal
-        # For simplicity, we'll use a simple breadth-first search (BFS)
-        # Create a queue for BFS and a set to track visited positions
-        queue = [(start[0], start[1])]
-        visited = {(start[0], start[1])}
-
-        while queue:
-            current = queue.pop(0)
-
-            # If we reached the goal, a path exists
-            if current == (goal[0], goal[1]):
-                return True
-
-            # Check all 4 adjacent positions
-            for dx, dy in [(0,1), (1,0), (0,-1), (-1,0)]:
-                next_x = current[0] + dx
-                next_y = current[1] + dy
-                next_pos = (next_x, next_y)
+        # Find how far every cell is from the goal with a breadth-first search (see mazes/search.py).
+        # We keep the answer on the maze so training and evaluation can use it without searching again:
+        #  - goal_distance[y, x] is the fewest steps from (x, y) to the goal, or -1 if there is no way there
+        #  - reachable[y, x] is True for the cells connected to the goal (and so to the start, if there is a path)
+        if self.saved_tables is not None:
+            self.goal_distance = self.saved_tables["goal_distance"]
+        else:
+            self.goal_distance = distance_field(np.asarray(self.maze) == 0, goal)
+        self.reachable = self.goal_distance >= 0
+        return bool(self.reachable[start[1], start[0]])
 
-                # Check if position is valid and unvisited
-                if (0 <= next_x < self.maze_width and
-                    0 <= next_y < self.maze_height and
-                    self.maze[next_y][next_x] == 0 and
-                    next_pos not in visited):
+    def optimal_path_length(self):
+        """
+        The fewest steps it takes to get from the start to the goal.
+        """
+        return int(self.goal_distance[self.start_position[1], self.start_position[0]])
 
-                    queue.append(next_pos)
-                    visited.add(next_pos)
+    def _steps_through_tables(self):
+        """
+        The fewest steps from the start state to the goal with a breadth-first search over next_state,
+        or -1 if the goal is never reached. Unlike goal_distance this follows the moves the tables allow,
+        so mazes where the state is more than the position (keys, doors) use it for optimal_path_length.
+        """
+        start = self.state_index(self.start_position)
+        visited = np.zeros(self.num_states, dtype=bool)
+        visited[start] = True
+        frontier = np.array([start])
+        steps = 0
+        while frontier.size:
+            steps += 1
+            if (self.reward_code[frontier] == GOAL).any():
+                return steps
+            frontier = np.unique(self.next_state[frontier])
+            frontier = frontier[~visited[frontier]]
+            visited[frontier] = True
+        return -1
+
+    def constructor_arguments(self):
+        """
+        Any arguments besides the grid, start and goal needed to make this maze again.
+        """
+        return {}
 
-        # No path found
-        return False
+    def save(self, directory):
+        """
+        Save the grid and the tables to a folder, so load() can open them without working anything out again.
+        """
+        os.makedirs(directory, exist_ok=True)
+        packed = isinstance(self.maze, PackedGrid)
+        np.save(os.path.join(directory, "grid.npy"), self.maze.bits if packed else self.maze)
+        for name in ("next_state", "reward_code", "goal_distance"):
+            if getattr(self, name) is not None:
+                np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        meta = {
+            "maze": type(self).__name__,
+            "start_position": [int(value) for value in self.start_position],
+            "goal_position": [int(value) for value in self.goal_position],
+            "shape": list(self.maze.shape),
+            "packed": packed,
+            "arguments": self.constructor_arguments(),
+        }
+        with open(os.path.join(directory, "maze.json"), "w") as meta_file:
+            json.dump(meta, meta_file)
+
+    @classmethod
+    def load(cls, directory, mmap_mode="r"):
+        """
+        Open a maze saved with save(). With mmap_mode="r" the grid and tables are memory mapped read only,
+        so they are only read from disk as they are used and processes opening the same folder share them.
+        """
+        with open(os.path.join(directory, "maze.json")) as meta_file:
+            meta = json.load(meta_file)
+        grid = np.load(os.path.join(directory, "grid.npy"), mmap_mode=mmap_mode)
+        if meta["packed"]:
+            grid = PackedGrid.from_bits(grid, meta["shape"])
+        tables = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+                  for name in ("next_state", "reward_code", "goal_distance")
+                  if os.path.exists(os.path.join(directory, f"{name}.npy"))}
+        arguments = dict(meta["arguments"])
+        if "next_state" not in tables:
+            # Saved from a maze made with build_tables=False
+            arguments["build_tables"] = False
+        return cls(grid, tuple(meta["start_position"]), tuple(meta["goal_position"]), saved_tables=tables, **arguments)
+
+    def reachable_states(self):
+        """
+        The state ids (see state_index) of every position that is connected to the goal.
+        """
+        return np.flatnonzero(self.reachable.T.reshape(-1))
 
 
     def show_maze(self):
+        import matplotlib.pyplot as plt
+
         # Visualize the maze using Matplotlib
-        plt.figure(figsize=(self.maze_width,self.maze_height))
+        plt.figure(figsize=figure_size(self.maze_width, self.maze_height))
 
         # Display the maze as an image in grayscale ('gray' colormap)
-        plt.imshow(self.maze, cmap='gray')
+        plt.imshow(np.asarray(self.maze), cmap='gray')
 
         # Add start and goal positions as 'S' and 'G'
         plt.text(self.start_position[0], self.start_position[1], 'Start', ha='center', va='center', color='red', fontsize=20)
@@ -0,0 +1,126 @@
+from mazes.env import STEP, WALL, GOAL
+
+
+import numpy as np
+
+
+class BatchedMaze:
+    """
+    Many copies of a maze being walked at the same time.
+
+    Each "lane" is one walker with its own position. Every call to step() moves all of the
+    lanes at once using numpy arrays instead of a python loop, so thousands of episodes can
+    be run side by side.
+
+    The lanes can all share one maze grid or each lane can have its own grid (a stack of
+    mazes that are all the same size).
+
+    Actions are integers that index into get_actions(), so action 0 is "down", 1 is "up", ...
+    Rewards come back as the integer codes from mazes.env (STEP, WALL, GOAL).
+    Lanes that reach their goal are sent back to their start ready for the next step.
+    """
+
+    def __init__(self,
+                 maze_grids,
+                 start_positions,
+                 goal_positions,
+                 batch_size=None):
+        grids = np.asarray(maze_grids)
+        if grids.ndim == 2:
+            grids = grids[np.newaxis]
+        if grids.ndim != 3:
+            raise ValueError("Maze grids must be a 2D array or a stack of 2D arrays")
+
+        if batch_size is None:
+            batch_size = grids.shape[0]
+        if grids.shape[0] not in (1, batch_size):
+            raise ValueError("Need either one shared maze grid or one grid per lane")
+
+        self.batch_size = batch_size
+        self.walls = grids != 0  # True where there is a wall
+        self.maze_height = grids.shape[1]
+        self.maze_width = grids.shape[2]
+        # Which grid each lane walks in (all zeros when the grid is shared)
+        self.lane_grid = np.arange(batch_size) if grids.shape[0] > 1 else np.zeros(batch_size, dtype=int)
+
+        # Positions are (x, y) pairs, one row per lane
+        self.start_positions = np.broadcast_to(np.asarray(start_positions, dtype=np.int64), (batch_size, 2)).copy()
+        self.goal_positions = np.broadcast_to(np.asarray(goal_positions, dtype=np.int64), (batch_size, 2)).copy()
+        self.positions = self.start_positions.copy()
+
+        # Same ordering as Maze.get_actions() / Maze.action_step_map
+        self.actions = ["down", "up", "left", "right"]
+        self.action_steps = np.array([[0, 1], [0, -1], [-1, 0], [1, 0]], dtype=np.int64)
+
+        self.episode_steps = np.zeros(batch_size, dtype=np.int64)  # Steps taken in each lane's current episode
+        self.episodes_done = np.zeros(batch_size, dtype=np.int64)  # Number of times each lane reached the goal
+
+    @classmethod
+    def from_maze(cls, maze, batch_size):
+        """
+        Run batch_size walkers through a single Maze.
+        """
+        return cls(maze.maze, maze.start_position, maze.goal_position, batch_size)
+
+    @classmethod
+    def from_mazes(cls, mazes):
+        """
+        Run one walker through each Maze in the list. The mazes must all be the same size.
+        """
+        return cls(np.stack([maze.maze for maze in mazes]),
+                   [maze.start_position for maze in mazes],
+                   [maze.goal_position for maze in mazes])
+
+    def reset(self):
+        """
+        Send every lane back to its start position.
+        """
+        self.positions[:] = self.start_positions
+        self.episode_steps[:] = 0
+
+    def get_current_state(self):
+        """
+        Return the (x, y) position of every lane.
+        """
+        return self.positions.copy()
+
+    def get_actions(self):
+        return self.actions
+
+    def step(self, actions):
+        """
+        Move every lane by one action.
+
+        Args:
+            actions: Integer array with one action index per lane.
+
+        Returns:
+            next_positions: (batch_size, 2) array of where each lane ended up. For lanes that reached the goal this is the goal.
+            reward_codes: Integer reward code for each lane (STEP, WALL or GOAL).
+            is_done: Boolean array, True for the lanes that reached the goal on this step.
+        """
+        next_positions = self.positions + self.action_steps[actions]
+        x = next_positions[:, 0]
+        y = next_positions[:, 1]
+
+        # Out of bounds or running into a wall both count as a wall hit
+        in_bounds = (x >= 0) & (x < self.maze_width) & (y >= 0) & (y < self.maze_height)
+        hit_wall = ~in_bounds
+        hit_wall[in_bounds] = self.walls[self.lane_grid[in_bounds], y[in_bounds], x[in_bounds]]
+
+        # Lanes that hit a wall stay where they are
+        next_positions[hit_wall] = self.positions[hit_wall]
+        is_done = ~hit_wall & np.all(next_positions == self.goal_positions, axis=1)
+
+        reward_codes = np.full(self.batch_size, STEP, dtype=np.int8)
+        reward_codes[hit_wall] = WALL
+        reward_codes[is_done] = GOAL
+
+        self.episode_steps += 1
+        self.episodes_done += is_done
+
+        # Finished lanes start a new episode
+        self.positions = np.where(is_done[:, np.newaxis], self.start_positions, next_positions)
+        self.episode_steps[is_done] = 0
+
+        return next_positions, reward_codes, is_done
@@ -1,3 +1,12 @@
+# Integer codes for the reward signals an environment can report.
+# The string names are what interact() returns, the codes are what the array based code paths use.
+REWARD_SIGNALS = ["step", "wall", "goal", "goal_locked", "got_key"]
+STEP, WALL, GOAL, GOAL_LOCKED, GOT_KEY = range(len(REWARD_SIGNALS))
+
+# The rewards the scripts train with when they aren't given any
+default_reward_map = {"wall": -10, "step": -1, "goal": 100}
+
+
 class Environment:
 
     def reset(self):
@@ -10,4 +19,4 @@ class Environment:
         pass
 
     def interact(self, action):
-        pass
\ No newline at end of file
+        pass
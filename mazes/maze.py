@@ -1,54 +1,215 @@
 
 from mazes.basic_maze import Maze
+from mazes.storage import PackedGrid
+from mazes.env import REWARD_SIGNALS, STEP, WALL, GOAL, GOAL_LOCKED, GOT_KEY
 
 
+import numpy as np
+
 
 class KeyMaze(Maze):
+    """
+    A maze where the goal is locked until the key has been picked up.
+
+    The state is the position together with whether we have the key, so the transition tables
+    cover both: state ids without the key come first and state ids with the key come after them,
+        state = has_key * num_positions + position state id
+    """
     def __init__(self, 
                  maze_specification, 
                  start_position, 
                  goal_position, 
-                 key_position):
-        super().__init__(maze_specification, start_position, goal_position)
+                 key_position,
+                 grid_storage=None,
+                 saved_tables=None):
         self.key_position = key_position  # Set the key position in the maze as a tuple (x, y)
         self.has_key = False  # Initialize key status
+        self.goal_steps = None  # Worked out the first time optimal_path_length is asked for
+        super().__init__(maze_specification, start_position, goal_position, grid_storage, saved_tables)
+
+    def constructor_arguments(self):
+        return {"key_position": [int(value) for value in self.key_position]}
 
     def reset(self):
         self.current_position = self.start_position
         self.has_key = False
 
+    def optimal_path_length(self):
+        """
+        The fewest steps from the start to the goal, fetching the key on the way.
+        """
+        if self.goal_steps is None:
+            self.goal_steps = self._steps_through_tables()
+        return self.goal_steps
+
     def get_current_state(self):
         return {
             "position": self.current_position,
             "has_key": self.has_key
         }
 
+    def get_state_index(self):
+        return self.has_key * self.num_positions + self.state_index(self.current_position)
+
     def interact(self, action):
-        action_step = self.action_step_map[action]
-        next_position = [self.current_position[0] + action_step[0], self.current_position[1] + action_step[1]]
+        next_state_idx, reward_code, is_done = self.step_index(self.get_state_index(), self.action_index[action])
 
-        if self.wall_check(next_position):            
+        if reward_code == WALL:
             return self.get_current_state(), "wall", False
-        
-        # Check if the agent reached the goal
-        if self.has_key and self.goal_check(next_position):
-            self.current_position = next_position
-            return self.get_current_state(), "goal", True
-        
-        if not self.has_key and self.goal_check(next_position):
-            self.current_position = next_position
-            return self.get_current_state(), "goal_locked", False
-
-        if next_position == self.key_position:
-            self.current_position = next_position
-            if not self.has_key:
-                print(f"GOT THE KEY! at {self.current_position} - matching {self.key_position}")
-            self.has_key = True  # Collect the key
-            reward_signal = "got_key"
-            return self.get_current_state(), "got_key", False
-
-        self.current_position = next_position
-        return { "position" : next_position, "has_key" : self.has_key }, "step", False
-
-
-        
+
+        self.current_position = self.position_from_index(next_state_idx)
+        if reward_code == GOT_KEY and not self.has_key:
+            print(f"GOT THE KEY! at {self.current_position} - matching {self.key_position}")
+        self.has_key = next_state_idx >= self.num_positions
+        return self.get_current_state(), REWARD_SIGNALS[reward_code], is_done
+
+    def _build_transition_table(self):
+        """
+        Build the next_state and reward_code tables for both halves of the state space (without and with the key).
+        """
+        next_position, hit_wall = self._position_moves()
+        at_goal = ~hit_wall & (next_position == self.state_index(self.goal_position))
+        at_key = ~hit_wall & ~at_goal & (next_position == self.state_index(self.key_position))
+
+        # Without the key: the goal is locked, and walking onto the key moves us into the "has key" half
+        next_without_key = np.where(at_key, next_position + self.num_positions, next_position)
+        reward_without_key = np.full(next_position.shape, STEP, dtype=np.int8)
+        reward_without_key[hit_wall] = WALL
+        reward_without_key[at_goal] = GOAL_LOCKED
+        reward_without_key[at_key] = GOT_KEY
+
+        # With the key: the goal is open, walking onto the key again still reports got_key
+        next_with_key = next_position + self.num_positions
+        reward_with_key = reward_without_key.copy()
+        reward_with_key[at_goal] = GOAL
+
+        next_state = np.concatenate([next_without_key, next_with_key]).astype(np.int32)
+        reward_code = np.concatenate([reward_without_key, reward_with_key])
+        return next_state, reward_code
+
+
+class ItemMaze(Maze):
+    """
+    A maze with any number of keys and doors. Key i opens door i, and a door is a wall until its key
+    has been picked up. A door can also sit on the goal, then the goal is locked like in a KeyMaze
+    (so ItemMaze(grid, start, goal, keys=[key], doors=[goal]) plays the same as KeyMaze(grid, start, goal, key)).
+
+    The keys we are holding are kept as one integer, the inventory, with bit i set once key i has
+    been picked up. The state is the position together with the inventory:
+        state = inventory * num_positions + position state id
+    so there are 2 ** len(keys) times as many states as positions, and the transition tables (and a
+    q_table with a row for every state, see agents.StateQLearningAgent) cover all of them.
+
+    What is on every cell is worked out once in item_grid[y, x]: 0 for nothing, i + 1 for key i and
+    -(i + 1) for door i, so finding the item at a position is a single lookup.
+    """
+
+    def __init__(self,
+                 maze_specification,
+                 start_position,
+                 goal_position,
+                 keys,
+                 doors=(),
+                 grid_storage=None,
+                 saved_tables=None):
+        self.keys = [tuple(int(value) for value in key) for key in keys]      # Key positions (x, y)
+        self.doors = [tuple(int(value) for value in door) for door in doors]  # Door positions (x, y), door i needs key i
+        self.inventory = 0
+        if not isinstance(maze_specification, PackedGrid):
+            maze_specification = np.asarray(maze_specification)
+        self.item_grid = self.__make_item_grid(maze_specification.shape)
+        super().__init__(maze_specification, start_position, goal_position, grid_storage, saved_tables)
+        self.__validate_items()
+
+        # The doors might block every way to the goal, so find the fewest steps with them in the way
+        self.goal_steps = self._steps_through_tables()
+        if self.goal_steps < 0:
+            raise ValueError("The goal can't be reached, the doors block every way there")
+
+    def __make_item_grid(self, shape):
+        if len(shape) != 2:
+            raise ValueError("Maze must be a 2D array")
+        if len(self.doors) > len(self.keys):
+            raise ValueError("Every door needs a key")
+        # Keep the state ids inside int32 for the transition tables
+        if (2 ** len(self.keys)) * shape[0] * shape[1] >= 2 ** 31:
+            raise ValueError(f"{len(self.keys)} keys make too many states for a {shape[1]}x{shape[0]} maze")
+
+        item_grid = np.zeros(shape, dtype=np.int16)
+        for item_id, (x, y) in [(ix + 1, key) for ix, key in enumerate(self.keys)] + [(-(ix + 1), door) for ix, door in enumerate(self.doors)]:
+            if not (0 <= x < shape[1] and 0 <= y < shape[0]):
+                raise ValueError(f"Item at {(x, y)} is out of bounds")
+            if item_grid[y, x] != 0:
+                raise ValueError(f"Two items at {(x, y)}")
+            item_grid[y, x] = item_id
+        return item_grid
+
+    def __validate_items(self):
+        for x, y in self.keys + self.doors:
+            if self.maze[y][x] == 1:
+                raise ValueError(f"Item at {(x, y)} is on a wall")
+
+    def constructor_arguments(self):
+        return {"keys": [list(key) for key in self.keys], "doors": [list(door) for door in self.doors]}
+
+    def item_at(self, position):
+        """
+        What is at an (x, y) position: 0 for nothing, i + 1 for key i, -(i + 1) for door i.
+        """
+        return int(self.item_grid[position[1], position[0]])
+
+    def reset(self):
+        self.current_position = self.start_position
+        self.inventory = 0
+
+    def get_current_state(self):
+        return {"position": self.current_position, "inventory": self.inventory}
+
+    def get_state_index(self):
+        return self.inventory * self.num_positions + self.state_index(self.current_position)
+
+    def interact(self, action):
+        next_state_idx, reward_code, is_done = self.step_index(self.get_state_index(), self.action_index[action])
+
+        if reward_code != WALL:
+            self.current_position = self.position_from_index(next_state_idx)
+            self.inventory = next_state_idx // self.num_positions
+        return self.get_current_state(), REWARD_SIGNALS[reward_code], is_done
+
+    def optimal_path_length(self):
+        """
+        The fewest steps from the start to the goal, going round (or fetching the keys for) the doors.
+        """
+        return self.goal_steps
+
+    def _build_transition_table(self):
+        """
+        Build the next_state and reward_code tables, one block of num_positions states for every inventory.
+        """
+        next_position, hit_wall = self._position_moves()
+        positions = np.arange(self.num_positions)[:, np.newaxis]
+
+        # The key bit we pick up and the key bit we need, for the cell every move goes to
+        items = self.item_grid.T.reshape(-1)[next_position].astype(np.int64)
+        key_bits = np.where(items > 0, 1 << np.maximum(items - 1, 0), 0)
+        door_bits = np.where(items < 0, 1 << np.maximum(-items - 1, 0), 0)
+        at_goal = ~hit_wall & (next_position == self.state_index(self.goal_position))
+
+        num_inventories = 2 ** len(self.keys)
+        next_state = np.empty((num_inventories * self.num_positions, len(self.action_index)), dtype=np.int32)
+        reward_code = np.empty(next_state.shape, dtype=np.int8)
+        for inventory in range(num_inventories):
+            locked = (door_bits & ~inventory) != 0
+            # A locked door is a wall, except on the goal where we step on but it stays shut
+            blocked = hit_wall | (locked & ~at_goal)
+
+            block = slice(inventory * self.num_positions, (inventory + 1) * self.num_positions)
+            next_state[block] = np.where(blocked, inventory * self.num_positions + positions,
+                                         (inventory | key_bits) * self.num_positions + next_position)
+            codes = np.full(next_position.shape, STEP, dtype=np.int8)
+            codes[~blocked & (key_bits != 0)] = GOT_KEY
+            codes[at_goal & locked] = GOAL_LOCKED
+            codes[at_goal & ~locked] = GOAL
+            codes[blocked] = WALL
+            reward_code[block] = codes
+        return next_state, reward_code
@@ -1,6 +1,11 @@
-from mazes.Maze_1 import Maze
+from mazes.basic_maze import Maze
+from mazes.maze import ItemMaze, KeyMaze
+from mazes.search import distance_field
 
 
+import json
+import os
+
 import numpy as np
 
 
@@ -18,50 +23,157 @@ def get_first_example_maze():
     return maze
 
 
-def prims_maze(size):
-    maze = np.ones((size, size))
-    start = (0, 0)
-    maze[start[1]][start[0]] = 0
+def global_seed(seed):
+    """
+    Without a seed, take one from numpy's global random numbers, so np.random.seed(...) before making
+    a maze still makes it the same every time.
+    """
+    return seed if seed is not None else int(np.random.randint(2 ** 32, dtype=np.int64))
+
+
+def prims_maze(size, seed=None):
+    """
+    Make a size x size maze with a randomized version of Prim's algorithm.
+
+    Starting from the top left corner we keep a list of walls next to the part of the maze we have
+    already carved out. We pick one at random and knock it down if it only touches one carved cell.
+    Each wall is removed from the list in constant time, so this takes time proportional to the
+    number of cells.
+
+    seed can be anything np.random.default_rng accepts, so the same seed always gives the same maze.
+    Without one the seed comes from numpy's global random numbers (see global_seed). The mazes are
+    not the same ones older versions made after the same np.random.seed.
+    """
+    rng = np.random.default_rng(global_seed(seed))
+    maze = prims_grid(size, rng)
+    return Maze(maze, (0,0), (size-1,size-1))
+
+
+def prims_mazes(size, count, seed=None):
+    """
+    Make count different prims mazes. Each one gets its own random numbers made from seed.
+    """
+    return [prims_maze(size, maze_seed) for maze_seed in np.random.SeedSequence(global_seed(seed)).spawn(count)]
+
+
+def make_maze(size, seed=0):
+    """
+    "example" is the maze from get_first_example_maze, a number is a prims_maze of that size made with seed.
+    """
+    if size == "example":
+        return get_first_example_maze()
+    return prims_maze(int(size), seed=seed)
+
+
+def load_maze(directory, mmap_mode="r"):
+    """
+    Open a maze saved with Maze.save as the same kind of maze it was (Maze, KeyMaze or ItemMaze).
+    """
+    with open(os.path.join(directory, "maze.json")) as meta_file:
+        kind = json.load(meta_file).get("maze", "Maze")
+    maze_classes = {maze_class.__name__: maze_class for maze_class in (Maze, KeyMaze, ItemMaze)}
+    if kind not in maze_classes:
+        raise ValueError(f"Don't know how to load a {kind}")
+    return maze_classes[kind].load(directory, mmap_mode)
+
+
+def prims_grid(size, rng):
+    """
+    The maze grid for prims_maze: 0 is open, 1 is a wall.
+    """
+    # Work on a flat grid with an extra border of "outside" cells (2) all the way around,
+    # so a cell's neighbors are just cell +/- 1 and cell +/- stride and we never go out of bounds.
+    stride = size + 2
+    cells = bytearray([2]) * (stride * stride)
+    for y in range(size):
+        row_start = (y + 1) * stride + 1
+        cells[row_start:row_start + size] = bytes([1]) * size
+    neighbor_offsets = (1, -1, stride, -stride)
+
+    start = stride + 1  # (0, 0)
+    cells[start] = 0
 
     # List of walls to consider
-    walls = [(0,1), (1,0)]
+    walls = [start + stride, start + 1]
+
+    # Random numbers are drawn in blocks, it is much quicker than one at a time
+    randoms = []
+    k = 0
 
     while walls:
-        wall = walls.pop(np.random.randint(len(walls)))
-        x, y = wall
+        if k == len(randoms):
+            randoms = rng.random(4096).tolist()
+            k = 0
+        # Pick a random wall and remove it from the list by swapping the last wall into its place
+        index = int(randoms[k] * len(walls))
+        k += 1
+        wall = walls[index]
+        walls[index] = walls[-1]
+        walls.pop()
+        if cells[wall] != 1:
+            continue
 
         # Count number of visited neighbors
-        neighbors = [(x+1,y), (x-1,y), (x,y+1), (x,y-1)]
-        visited = sum(1 for nx, ny in neighbors
-                     if 0 <= nx < size and 0 <= ny < size
-                     and maze[ny][nx] == 0)
+        visited = (cells[wall + 1] == 0) + (cells[wall - 1] == 0) + (cells[wall + stride] == 0) + (cells[wall - stride] == 0)
 
         if visited == 1:  # Only one visited neighbor
-            maze[y][x] = 0
-            for nx, ny in neighbors:
-                if (0 <= nx < size and 0 <= ny < size
-                    and maze[ny][nx] == 1):
-                    walls.append((nx, ny))
+            cells[wall] = 0
+            for offset in neighbor_offsets:
+                if cells[wall + offset] == 1:
+                    walls.append(wall + offset)
+
+    maze = np.frombuffer(bytes(cells), dtype=np.uint8).reshape(stride, stride)[1:-1, 1:-1].copy()
+
+    # Every carved cell joins on to the carved part of the maze, but the goal corner is just opened up
+    # at the end and can be boxed in. If so, dig a path to the closest open cell.
+    goal = size - 1
+    if maze[goal - 1, goal] == 1 and maze[goal, goal - 1] == 1:
+        open_y, open_x = np.nonzero(maze == 0)
+        closest = np.argmin((goal - open_x) + (goal - open_y))
+        maze[open_y[closest]:, open_x[closest]] = 0
+        maze[goal, open_x[closest]:] = 0
 
     maze[size-1][size-1] = 0
-    return Maze(maze, (0,0), (size-1,size-1))
+    return maze
 
 
-def random_maze(size):
-    k = 0
-    max_attempts = 10000  # Prevent infinite loop
-    while k < max_attempts:
-        k += 1
-        maze = np.random.randint(2, size=(size, size))
+def random_maze(size, seed=None, max_attempts=10000):
+    """
+    Make a size x size maze where every cell is randomly a wall or open.
+
+    Most random grids have no path from start to goal, so we keep making them until one does.
+    Many grids are made at once and all of them are checked with a single search (see distance_field).
+    """
+    return random_mazes(size, 1, seed=seed, max_attempts=max_attempts)[0]
+
+
+def random_mazes(size, count, seed=None, max_attempts=10000):
+    """
+    Make count random mazes that all have a path from start to goal.
+    """
+    rng = np.random.default_rng(global_seed(seed))
+    start_position = (0, 0)
+    goal_position = (size-1, size-1)
+
+    # How many grids to try at once, kept to a few million cells
+    batch_size = max(1, min(256, (1 << 22) // (size * size)))
+
+    mazes = []
+    attempts = 0
+    while len(mazes) < count:
+        if attempts >= max_attempts:  # Prevent infinite loop
+            raise ValueError(f"Could not make {count} random mazes with a path in {max_attempts} attempts")
+        batch = min(batch_size, max_attempts - attempts)
+        attempts += batch
+
+        grids = rng.integers(2, size=(batch, size, size), dtype=np.uint8)
         # Ensure start and goal positions are open
-        maze[0,0] = 0
-        maze[size-1,size-1] = 0
-
-        # Create maze instance
-        start_position = (0, 0)
-        goal_position = (size-1, size-1)
-        try:
-            maze_instance = Maze(maze, start_position, goal_position)
-            return maze_instance
-        except ValueError:
-            continue
\ No newline at end of file
+        grids[:, start_position[1], start_position[0]] = 0
+        grids[:, goal_position[1], goal_position[0]] = 0
+
+        # Keep the grids where the goal can be reached from the start
+        distances = distance_field(grids == 0, start_position)
+        for grid in grids[distances[:, goal_position[1], goal_position[0]] >= 0]:
+            if len(mazes) < count:
+                mazes.append(Maze(grid, start_position, goal_position))
+    return mazes
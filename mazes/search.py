@@ -0,0 +1,45 @@
+import numpy as np
+
+
+def distance_field(open_cells, start):
+    """
+    How many steps it takes to walk from start to every cell, without going through walls.
+
+    This is a breadth-first search, but instead of visiting cells one at a time it grows the whole
+    frontier (every cell at the same distance) at once with numpy, so each cell is handled once.
+
+    Args:
+        open_cells: Boolean array, True where we can walk. Either one maze grid (height, width)
+                    or a stack of maze grids (count, height, width) that are all searched at once.
+        start: The (x, y) position to measure from, the same for every maze in a stack.
+
+    Returns:
+        An int32 array the same shape as open_cells with the number of steps to each cell,
+        or -1 for cells that can't be reached.
+    """
+    open_cells = np.asarray(open_cells, dtype=bool)
+    height, width = open_cells.shape[-2:]
+    is_open = open_cells.reshape(-1)
+    distances = np.full(is_open.shape, -1, dtype=np.int32)
+
+    # Every maze in the stack starts at the same (x, y)
+    num_mazes = is_open.size // (height * width)
+    frontier = np.arange(num_mazes) * (height * width) + start[1] * width + start[0]
+    frontier = frontier[is_open[frontier]]
+
+    distance = 0
+    while frontier.size:
+        distances[frontier] = distance
+        distance += 1
+
+        # Step in all four directions, staying inside each maze
+        x = frontier % width
+        y = (frontier // width) % height
+        neighbors = np.concatenate([frontier[x > 0] - 1,
+                                    frontier[x < width - 1] + 1,
+                                    frontier[y > 0] - width,
+                                    frontier[y < height - 1] + width])
+        neighbors = neighbors[is_open[neighbors] & (distances[neighbors] < 0)]
+        frontier = np.unique(neighbors)
+
+    return distances.reshape(open_cells.shape)
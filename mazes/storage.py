@@ -0,0 +1,64 @@
+"""
+Storing wall grids in less memory.
+
+A maze grid only ever holds 0 (open) and 1 (wall), so it doesn't need 8 bytes a cell:
+ - "uint8" or "bool" keep one byte a cell
+ - "bits" packs 8 cells into every byte with a PackedGrid, so a 4000x4000 maze takes 2MB
+
+Maze(..., grid_storage="bits") stores its grid that way. See also Maze.save and Maze.load, which put a
+maze's grid and tables in files that can be memory mapped.
+"""
+import numpy as np
+
+
+class PackedGrid:
+    """
+    A wall grid with one bit per cell. It can be read like the array it came from: grid[y][x],
+    grid[y, x] (with arrays of indices too), grid.shape, and np.asarray(grid) to unpack the whole thing.
+    """
+
+    ndim = 2
+
+    def __init__(self, grid):
+        grid = np.asarray(grid)
+        self.shape = grid.shape
+        self.bits = np.packbits(grid != 0, axis=1)
+
+    @classmethod
+    def from_bits(cls, bits, shape):
+        """
+        Wrap bits that are already packed, for example a memory mapped file.
+        """
+        grid = cls.__new__(cls)
+        grid.shape = tuple(shape)
+        grid.bits = bits
+        return grid
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            y, x = key
+            x = np.asarray(x)
+            return ((self.bits[y, x >> 3] >> (7 - (x & 7))) & 1).astype(np.uint8)
+        # A single row
+        return np.unpackbits(self.bits[key], count=self.shape[1])
+
+    def __array__(self, dtype=None, copy=None):
+        grid = np.unpackbits(self.bits, axis=1, count=self.shape[1])
+        return grid if dtype is None else grid.astype(dtype)
+
+
+def store_grid(grid, grid_storage=None):
+    """
+    Convert a wall grid to the given storage: None (keep it as it is), "uint8", "bool" or "bits".
+    """
+    if grid_storage is None:
+        return grid
+    if grid_storage == "bits":
+        return grid if isinstance(grid, PackedGrid) else PackedGrid(grid)
+    if grid_storage in ("uint8", "bool"):
+        return np.asarray(grid, dtype=np.dtype(grid_storage))
+    raise ValueError(f"Unknown grid_storage {grid_storage!r}, use None, 'uint8', 'bool' or 'bits'")
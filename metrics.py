@@ -0,0 +1,111 @@
+"""
+Keeping track of how training went.
+
+train_agent fills in a TrainingMetrics as it goes and hands it to any callbacks after every episode.
+Printing and plotting are just callbacks, so they can be left out when nobody is watching
+(for example when training lots of agents on a server). matplotlib is only imported when
+something is actually plotted.
+"""
+import time
+
+import numpy as np
+
+
+class TrainingMetrics:
+    """
+    Everything we measure while training: the reward, steps and wall hits of every episode and how long it took.
+    """
+
+    def __init__(self):
+        self.episode_rewards = []
+        self.episode_steps = []
+        self.episode_wall_hits = []
+        self.start_time = time.perf_counter()
+        self.wall_time = 0.0  # Seconds spent training
+        self.stop_reason = None  # Why training stopped early, if it did
+        self.episodes_saved = 0  # How many of the agent's episodes were left when it stopped
+        self.converged_after = None  # Seconds until the greedy path was first a shortest path, when that is watched
+
+    def record_episode(self, episode_reward, episode_step, wall_hits):
+        self.episode_rewards.append(episode_reward)
+        self.episode_steps.append(episode_step)
+        self.episode_wall_hits.append(wall_hits)
+        self.wall_time = time.perf_counter() - self.start_time
+
+    def num_episodes(self):
+        return len(self.episode_rewards)
+
+    def average_reward(self):
+        return sum(self.episode_rewards) / len(self.episode_rewards)
+
+    def average_steps(self):
+        return sum(self.episode_steps) / len(self.episode_steps)
+
+    def steps_per_second(self):
+        return sum(self.episode_steps) / self.wall_time if self.wall_time > 0 else 0.0
+
+    def as_arrays(self):
+        """
+        Return the per-episode rewards, steps and wall hits as numpy arrays.
+        """
+        return np.array(self.episode_rewards), np.array(self.episode_steps), np.array(self.episode_wall_hits)
+
+
+class Callback:
+    """
+    Something that wants to hear about training as it happens. Override whichever methods you need.
+    """
+
+    def on_episode_end(self, agent, metrics):
+        pass
+
+    def on_train_end(self, agent, metrics):
+        pass
+
+
+class PrintProgress(Callback):
+    """
+    Print a line after every episode and the averages at the end, like train_agent always used to.
+    """
+
+    def on_episode_end(self, agent, metrics):
+        print(f"episode reward: {metrics.episode_rewards[-1]}, episode step: {metrics.episode_steps[-1]}")
+
+    def on_train_end(self, agent, metrics):
+        print(f"The average reward is: {metrics.average_reward()}")
+        print(f"The average steps is: {metrics.average_steps()}")
+        if metrics.stop_reason is not None:
+            print(f"Stopped early ({metrics.stop_reason}), saving {metrics.episodes_saved} episodes")
+
+
+class PlotProgress(Callback):
+    """
+    Plot the reward and steps per episode when training is finished.
+    """
+
+    def on_train_end(self, agent, metrics):
+        plot_training(metrics)
+
+
+def plot_training(metrics):
+    """
+    Plot the reward and the number of steps of every episode side by side.
+    """
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(10, 5))
+
+    plt.subplot(1, 2, 1)
+    plt.plot(metrics.episode_rewards)
+    plt.xlabel('Episode')
+    plt.ylabel('Cumulative Reward')
+    plt.title('Reward per Episode')
+
+    plt.subplot(1, 2, 2)
+    plt.plot(metrics.episode_steps)
+    plt.xlabel('Episode')
+    plt.ylabel('Steps Taken')
+    plt.title('Steps per Episode')
+
+    plt.tight_layout()
+    plt.show()
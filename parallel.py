@@ -0,0 +1,180 @@
+"""
+Training one agent with several processes at once.
+
+Every worker process runs its own episodes with run_single_simulation in the same maze, but they all
+read and write one q_table that lives in shared memory (multiprocessing.shared_memory). Nobody
+waits for a lock when updating it: two workers might now and then write the same q-value at the
+same moment and one update is lost, but that happens rarely and Q-learning doesn't mind. This is
+called Hogwild training.
+
+The workers also share an episode counter. Each worker takes the next episode number from it, and
+that number sets the exploration rate, so together they follow the same schedule as one agent
+playing num_episodes episodes.
+
+While the workers train, the main process keeps checking the greedy path in the shared q_table and
+notes when it first becomes the shortest path, to measure the time to convergence.
+
+From the command line, to see how the speed grows with the number of workers:
+    python parallel.py --size 50 --episodes 200 --workers 1 2 4 8
+"""
+import argparse
+import os
+import time
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from agents import QLearningAgent
+from metrics import TrainingMetrics
+from mazes.env import default_reward_map
+from mazes.maze_constructors import prims_maze
+from simulate import run_single_simulation
+from stopping import greedy_evaluation
+
+
+def run_worker(q_table_name, q_table_shape, results_name, episode_counter, maze, reward_map, settings, max_steps, seed):
+    """
+    One worker: keep taking the next episode from the shared counter and playing it, until all are done.
+    """
+    num_episodes = settings["num_episodes"]
+    q_table_memory = shared_memory.SharedMemory(name=q_table_name)
+    results_memory = shared_memory.SharedMemory(name=results_name)
+    try:
+        agent = QLearningAgent(maze, maze.get_actions(), **settings)
+        agent.q_table = np.ndarray(q_table_shape, dtype=np.float64, buffer=q_table_memory.buf)
+        # Each episode's reward, steps, wall hits and when it finished
+        results = np.ndarray((num_episodes, 4), dtype=np.float64, buffer=results_memory.buf)
+        np.random.seed(seed)
+        stats = {}
+        while True:
+            with episode_counter.get_lock():
+                episode = episode_counter.value
+                if episode >= num_episodes:
+                    break
+                episode_counter.value += 1
+
+            agent.current_episode = episode
+            episode_reward, episode_step, _ = run_single_simulation(agent, maze, train=True, reward_map=reward_map, max_steps=max_steps,
+                                                                    verbose=False, stats=stats, max_path_length=0)
+            results[episode] = episode_reward, episode_step, stats["wall_hits"], time.perf_counter()
+    finally:
+        # The arrays have to let go of the shared memory before it can be closed
+        agent = results = None
+        q_table_memory.close()
+        results_memory.close()
+
+
+def train_agent_parallel(agent, maze, reward_map, num_workers=None, max_steps=500000, seed=None, check_every=0.05):
+    """
+    Train a QLearningAgent with several worker processes sharing its q_table.
+
+    Args:
+        agent: The QLearningAgent to train. Its settings are used by every worker, all of its episodes
+            are played (from current_episode on), and the learned q_table is copied back into it.
+        maze: The maze to train in.
+        reward_map: Reward for each reward signal, e.g. {"wall": -10, "step": -1, "goal": 100}.
+        num_workers: How many processes, by default one per CPU.
+        max_steps: The most steps allowed in a single episode.
+        seed: Seed for the workers' random numbers.
+        check_every: Seconds between checks of the greedy path for the time to convergence.
+
+    Returns:
+        A TrainingMetrics with every episode in episode order. The episodes ran at the same time, so
+        wall_time is for the whole run and steps_per_second() counts the steps of all workers together.
+        converged_after is the seconds until the greedy path was first a shortest path, or None.
+    """
+    num_workers = num_workers if num_workers is not None else os.cpu_count()
+    settings = {name: getattr(agent, name) for name in
+                ("learning_rate", "discount_factor", "exploration_start", "exploration_end", "num_episodes")}
+    num_episodes = agent.num_episodes
+
+    q_table_memory = shared_memory.SharedMemory(create=True, size=agent.q_table.size * 8)
+    results_memory = shared_memory.SharedMemory(create=True, size=max(num_episodes, 1) * 4 * 8)
+    q_table = np.ndarray(agent.q_table.shape, dtype=np.float64, buffer=q_table_memory.buf)
+    results = np.ndarray((num_episodes, 4), dtype=np.float64, buffer=results_memory.buf)
+    q_table[...] = agent.q_table
+    results[...] = 0
+
+    episode_counter = multiprocessing.Value("q", agent.current_episode)
+    worker_seeds = np.random.SeedSequence(seed).generate_state(num_workers)
+    workers = [multiprocessing.Process(target=run_worker,
+                                       args=(q_table_memory.name, q_table.shape, results_memory.name, episode_counter,
+                                             maze, reward_map, settings, max_steps, int(worker_seed)))
+               for worker_seed in worker_seeds]
+
+    # The main process watches the greedy path in the shared table through an agent of its own
+    watcher = QLearningAgent(maze, maze.get_actions(), **settings)
+    watcher.q_table = q_table
+    shortest = maze.optimal_path_length()
+    converged_after = None
+
+    try:
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        while any(worker.is_alive() for worker in workers):
+            if converged_after is None:
+                _, episode_step, reached_goal = greedy_evaluation(watcher, maze, reward_map)
+                if reached_goal and episode_step == shortest:
+                    converged_after = time.perf_counter() - start
+            time.sleep(check_every)
+        for worker in workers:
+            worker.join()
+        wall_time = time.perf_counter() - start
+        if any(worker.exitcode != 0 for worker in workers):
+            raise RuntimeError("A training worker failed")
+
+        agent.q_table[...] = q_table
+        metrics = TrainingMetrics()
+        for episode_reward, episode_step, wall_hits, _ in results[agent.current_episode:].tolist():
+            metrics.record_episode(episode_reward, int(episode_step), int(wall_hits))
+        agent.current_episode = num_episodes
+        if converged_after is None:
+            _, episode_step, reached_goal = greedy_evaluation(agent, maze, reward_map)
+            if reached_goal and episode_step == shortest:
+                converged_after = wall_time
+    finally:
+        # The arrays have to let go of the shared memory before it can be freed
+        watcher.q_table = q_table = results = None
+        for memory in (q_table_memory, results_memory):
+            memory.close()
+            memory.unlink()
+
+    metrics.wall_time = wall_time
+    metrics.converged_after = converged_after
+    return metrics
+
+
+def scaling_report(maze, reward_map, worker_counts, num_episodes=100, max_steps=500000, seed=0):
+    """
+    Train the same agent with different numbers of workers and print how the speed changes.
+    """
+    rows = []
+    for num_workers in worker_counts:
+        agent = QLearningAgent(maze, maze.get_actions(), num_episodes=num_episodes)
+        metrics = train_agent_parallel(agent, maze, reward_map, num_workers, max_steps, seed)
+        rows.append((num_workers, metrics.steps_per_second(), metrics.wall_time, metrics.converged_after))
+
+    base = rows[0][1]
+    print(f"{'workers':>8s} {'steps/sec':>12s} {'speedup':>8s} {'seconds':>9s} {'converged after':>16s}")
+    for num_workers, steps_per_sec, wall_time, converged_after in rows:
+        converged = f"{converged_after:.2f}s" if converged_after is not None else "never"
+        print(f"{num_workers:8d} {steps_per_sec:12,.0f} {steps_per_sec / base:7.2f}x {wall_time:9.2f} {converged:>16s}")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train one agent with several processes sharing its q_table.")
+    parser.add_argument("--size", type=int, default=50, help="Size of the prims_maze")
+    parser.add_argument("--episodes", type=int, default=100)
+    parser.add_argument("--max-steps", type=int, default=500000, help="Most steps in one episode")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Numbers of workers to compare")
+    args = parser.parse_args()
+
+    maze = prims_maze(args.size, seed=0)
+    scaling_report(maze, default_reward_map, args.workers, args.episodes, args.max_steps)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Working out the best possible answer, so we can tell how close the agent is.
+
+A maze never changes and every move always does the same thing, so if we know the whole maze we
+don't need to learn anything: we can calculate the best value of every state directly. This is
+called value iteration. The value of a state is the best reward we can expect from there on,
+counting rewards that come later a little less (discount_factor):
+
+    Q*(state, action) = reward + discount_factor * V*(next state)
+    V*(state) = max over actions of Q*(state, action)
+
+Reaching the goal ends the episode, so nothing is added after a goal reward.
+
+Every state is updated at once with numpy arrays. Before that the values are filled in with one pass
+outwards from the goal, and after each round only the states next to a change are updated again,
+so even huge mazes only take a few seconds.
+
+The agent can then be compared against the best possible run with regret: how much less reward
+it collected in an episode than the optimal path would have.
+"""
+import numpy as np
+
+from fast_simulate import reward_table
+from metrics import Callback
+from mazes.env import GOAL
+
+
+def predecessors(maze):
+    """
+    For each state, the states that can move into it with one action.
+
+    Returned as two flat arrays: the states leading into state s are
+    previous_states[starts[s]:starts[s + 1]].
+    """
+    num_states, num_actions = maze.next_state.shape
+    from_states = np.repeat(np.arange(num_states), num_actions)
+    to_states = maze.next_state.reshape(-1)
+    previous_states = from_states[np.argsort(to_states, kind="stable")]
+    starts = np.concatenate([[0], np.cumsum(np.bincount(to_states, minlength=num_states))])
+    return starts, previous_states
+
+
+def states_leading_to(states, starts, previous_states):
+    """
+    Every state that can move into one of the given states, without repeats.
+    """
+    counts = starts[states + 1] - starts[states]
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.unique(previous_states[np.repeat(starts[states], counts) + offsets])
+
+
+def steps_to_goal(maze, starts=None, previous_states=None):
+    """
+    For every state, the fewest moves until the episode can end, or -1 if it never can.
+
+    This searches backwards through the maze's next_state table, so it works for any maze
+    with transition tables (including a KeyMaze, where the key has to be picked up first).
+    """
+    if starts is None:
+        starts, previous_states = predecessors(maze)
+
+    steps = np.full(maze.num_states, -1, dtype=np.int64)
+    frontier = np.flatnonzero(np.any(maze.reward_code == GOAL, axis=1))
+    distance = 1
+    while frontier.size:
+        steps[frontier] = distance
+        distance += 1
+        previous = states_leading_to(frontier, starts, previous_states)
+        frontier = previous[steps[previous] < 0]
+    return steps
+
+
+def value_iteration(maze,
+                    reward_map,
+                    discount_factor=0.9,
+                    tolerance=1e-6,
+                    max_iterations=10000):
+    """
+    Calculate the optimal values V* and Q* for every state of a Maze or KeyMaze.
+
+    Args:
+        maze: The maze to solve.
+        reward_map: Reward for each reward signal, e.g. {"wall": -10, "step": -1, "goal": 100}.
+        discount_factor: How much rewards that come later are worth, same as the agent's discount_factor.
+        tolerance: Stop when no value changes by more than this in a round of updates.
+        max_iterations: Most rounds of updates to do.
+
+    Returns:
+        state_values: V*[state]
+        q_values: Q*[state, action]
+        iterations: The number of rounds of updates it took
+    """
+    rewards = reward_table(reward_map)[maze.reward_code]
+    ends_episode = maze.reward_code == GOAL
+    next_state = maze.next_state
+    all_states = np.arange(maze.num_states)
+    starts, previous_states = predecessors(maze)
+
+    def q_of(states, state_values):
+        future = np.where(ends_episode[states], 0.0, state_values[next_state[states]])
+        return rewards[states] + discount_factor * future
+
+    # Head start: fill in the values one layer at a time, working outwards from the goal.
+    # Each layer only looks at layers that are already done, so this is the value of the shortest path.
+    steps = steps_to_goal(maze, starts, previous_states)
+    state_values = np.full(maze.num_states, -np.inf)
+    order = np.argsort(steps, kind="stable")
+    order = order[steps[order] > 0]
+    layer_ends = np.flatnonzero(np.diff(steps[order])) + 1
+    for layer in np.split(order, layer_ends):
+        state_values[layer] = q_of(layer, state_values).max(axis=1)
+    state_values[steps < 0] = 0.0
+
+    # States where every action bumps into a wall (like the inside of a thick wall) just collect
+    # the same reward forever, so their value can be written down straight away
+    active = all_states
+    if discount_factor < 1:
+        stuck = np.all(next_state == all_states[:, np.newaxis], axis=1) & ~np.any(ends_episode, axis=1)
+        state_values[stuck] = rewards[stuck].max(axis=1) / (1 - discount_factor)
+        active = all_states[~stuck]
+
+    # Now keep improving the values until nothing changes. Only states with a next state
+    # whose value changed in the last round need to be looked at again.
+    iterations = 0
+    while active.size and iterations < max_iterations:
+        iterations += 1
+        new_state_values = q_of(active, state_values).max(axis=1)
+        changed = active[np.abs(new_state_values - state_values[active]) >= tolerance]
+        state_values[active] = new_state_values
+        active = states_leading_to(changed, starts, previous_states)
+
+    return state_values, q_of(all_states, state_values), iterations
+
+
+def greedy_return(maze, q_values, reward_map, max_steps=500000):
+    """
+    The total reward of one episode that always takes the best action in q_values.
+
+    Far from the goal the discounted values of Q* can be so close that they are equal in floating
+    point, and then this can go round in circles. Use optimal_return for the best possible return.
+    """
+    rewards = reward_table(reward_map)
+    best_actions = np.argmax(q_values, axis=1)
+    state = maze.state_index(maze.start_position)
+    total_reward = 0.0
+    for step in range(max_steps):
+        action = best_actions[state]
+        total_reward += rewards[maze.reward_code[state, action]]
+        if maze.reward_code[state, action] == GOAL:
+            break
+        state = maze.next_state[state, action]
+    return float(total_reward)
+
+
+def optimal_return(maze, reward_map, steps=None):
+    """
+    The total reward of a shortest path from the start to the goal.
+
+    The path is followed by always moving to a state one step closer to the goal (see steps_to_goal),
+    so it works on big mazes and on a KeyMaze or ItemMaze too. When there are several such moves the
+    one with the highest reward is taken.
+
+    Args:
+        steps: steps_to_goal(maze), if it has been worked out already.
+    """
+    if steps is None:
+        steps = steps_to_goal(maze)
+    rewards = reward_table(reward_map)
+    state = maze.state_index(maze.start_position)
+    if steps[state] < 0:
+        raise ValueError("The goal can't be reached from the start")
+
+    total_reward = 0.0
+    while True:
+        codes = maze.reward_code[state]
+        if steps[state] == 1:
+            # The last move, onto the goal
+            return float(total_reward + rewards[GOAL])
+        next_states = maze.next_state[state]
+        closer = (steps[next_states] == steps[state] - 1) & (codes != GOAL)
+        action = np.flatnonzero(closer)[np.argmax(rewards[codes[closer]])]
+        total_reward += rewards[codes[action]]
+        state = next_states[action]
+
+
+def regret(optimal_return, episode_rewards):
+    """
+    How much less reward each episode got than the optimal path would have.
+    """
+    return optimal_return - np.asarray(episode_rewards)
+
+
+def value_grid(maze, state_values):
+    """
+    Lay the values of the positions out like the maze grid, value[y, x], ready for plt.imshow.
+    """
+    return state_values[:maze.num_positions].reshape(maze.maze_width, maze.maze_height).T
+
+
+class RegretTracker(Callback):
+    """
+    A train_agent callback that records the regret of every training episode.
+    """
+
+    def __init__(self, maze, reward_map):
+        self.optimal_return = optimal_return(maze, reward_map)
+        self.regrets = []
+
+    def on_episode_end(self, agent, metrics):
+        self.regrets.append(self.optimal_return - metrics.episode_rewards[-1])
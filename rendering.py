@@ -0,0 +1,244 @@
+"""
+Drawing mazes, paths and heatmaps straight into pictures, and turning them into videos.
+
+render_frame builds the whole picture as one RGB numpy array: walls, a heatmap (how often each cell
+was visited, or how good the agent thinks each cell is), the path, start, goal, keys and doors.
+Everything is drawn with array indexing, so even a long path on a big maze takes milliseconds, and
+the picture can be shown with a single plt.imshow or saved as a video frame.
+
+VideoWriter saves frames one at a time as they are made, so a video of a long training run never
+needs all of its frames in memory:
+ - through ffmpeg (for .mp4 or .gif) if it is installed
+ - otherwise through imageio if it is installed
+ - otherwise as numbered PNG files in a folder
+
+    with VideoWriter("training.mp4", fps=5) as video:
+        train_agent(agent, maze, reward_map, callbacks=[FrameRecorder(maze, video)])
+"""
+import os
+import shutil
+import struct
+import subprocess
+import zlib
+
+import numpy as np
+
+from metrics import Callback
+from simulate import run_single_simulation
+
+
+wall_color = np.array([255, 255, 255], dtype=np.uint8)  # Same as plt.imshow(maze, cmap='gray'): walls white,
+open_color = np.array([0, 0, 0], dtype=np.uint8)        # open cells black
+path_color = np.array([40, 90, 255], dtype=np.uint8)
+start_color = np.array([230, 30, 30], dtype=np.uint8)
+goal_color = np.array([30, 200, 60], dtype=np.uint8)
+key_color = np.array([250, 210, 0], dtype=np.uint8)
+door_color = np.array([150, 90, 40], dtype=np.uint8)
+
+# A dark purple -> orange -> yellow colour scale for heatmaps, 256 steps
+heat_colors = np.stack([
+    np.interp(np.linspace(0, 1, 256), [0, 0.5, 1], channel) for channel in ([40, 220, 250], [10, 90, 240], [90, 40, 60])
+], axis=1).astype(np.uint8)
+
+
+def visit_grid(maze, state_ids):
+    """
+    How many times each cell was visited, laid out like the grid as counts[y, x].
+    state_ids can be anything with state ids in it, like the "state" column of a TrajectoryReader.
+    """
+    positions = np.asarray(state_ids) % maze.num_positions
+    counts = np.bincount(positions, minlength=maze.num_positions)
+    return counts.reshape(maze.maze_width, maze.maze_height).T
+
+
+def q_value_grid(agent, layer=None):
+    """
+    The best q-value of each cell of a QLearningAgent, laid out like the grid as values[y, x].
+
+    A StateQLearningAgent has a layer of q-values for every inventory: pass layer to look at one
+    of them, by default each cell gets its best value over all the layers.
+    """
+    q_table = np.asarray(agent.q_table)
+    if q_table.ndim == 4:
+        q_table = q_table[layer] if layer is not None else q_table.max(axis=0)
+    return q_table.max(axis=2).T
+
+
+def greedy_path(agent, maze, max_steps=None):
+    """
+    The path of the agent always taking its best action, without printing or changing numpy's random numbers.
+    """
+    random_state = np.random.get_state()
+    _, _, path = run_single_simulation(agent, maze, train=False, max_steps=max_steps if max_steps is not None else maze.num_states,
+                                       verbose=False, greedy=True)
+    np.random.set_state(random_state)
+    return path
+
+
+def render_frame(maze, path=None, heatmap=None, scale=1, heat_alpha=0.8):
+    """
+    Draw the maze as an RGB picture.
+
+    Args:
+        maze: The Maze (or KeyMaze or ItemMaze) to draw.
+        path: Positions [x, y] to colour in, like the path from run_single_simulation.
+        heatmap: Numbers for each cell as heatmap[y, x], for example from visit_grid or q_value_grid.
+            They are coloured from lowest to highest on the open cells.
+        scale: Each cell becomes a scale x scale block of pixels.
+        heat_alpha: How strongly the heatmap covers the open cells (0 to 1).
+
+    Returns:
+        A (maze_height * scale, maze_width * scale, 3) uint8 array.
+    """
+    walls = np.asarray(maze.maze) == 1
+    image = np.where(walls[:, :, np.newaxis], wall_color, open_color)
+
+    if heatmap is not None:
+        heatmap = np.asarray(heatmap, dtype=np.float64)
+    # A maze with no open cells has nothing to colour
+    if heatmap is not None and heatmap[~walls].size:
+        open_values = heatmap[~walls]
+        low, high = open_values.min(), open_values.max()
+        # The walls aren't part of the colour range and are covered up below, clip them so they can be looked up
+        levels = np.zeros(heatmap.shape, dtype=np.int64) if high == low else np.clip((heatmap - low) / (high - low) * 255, 0, 255).astype(np.int64)
+        heat = heat_colors[levels]
+        blended = (heat_alpha * heat + (1 - heat_alpha) * image).astype(np.uint8)
+        image[~walls] = blended[~walls]
+
+    if path is not None and len(path):
+        xs, ys = np.asarray(path, dtype=np.int64).T
+        image[ys, xs] = path_color
+
+    # The keys and doors of an ItemMaze
+    item_grid = getattr(maze, "item_grid", None)
+    if item_grid is not None:
+        image[item_grid > 0] = key_color
+        image[item_grid < 0] = door_color
+
+    image[maze.start_position[1], maze.start_position[0]] = start_color
+    image[maze.goal_position[1], maze.goal_position[0]] = goal_color
+    key_position = getattr(maze, "key_position", None)
+    if key_position is not None:
+        image[key_position[1], key_position[0]] = key_color
+
+    if scale > 1:
+        image = np.repeat(np.repeat(image, scale, axis=0), scale, axis=1)
+    return image
+
+
+def write_png(filename, image):
+    """
+    Save an RGB uint8 image as a PNG, with nothing but zlib.
+    """
+    height, width, _ = image.shape
+    # Every row starts with a 0 byte: no filter
+    raw = np.concatenate([np.zeros((height, 1), dtype=np.uint8), image.reshape(height, width * 3)], axis=1)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    with open(filename, "wb") as png_file:
+        png_file.write(b"\x89PNG\r\n\x1a\n")
+        png_file.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        png_file.write(chunk(b"IDAT", zlib.compress(raw.tobytes(), 6)))
+        png_file.write(chunk(b"IEND", b""))
+
+
+class VideoWriter:
+    """
+    Write frames to a video one at a time. All frames must be the same size.
+
+    Args:
+        filename: A .mp4 or .gif file. If neither ffmpeg nor imageio is installed, the frames are
+            saved as PNG files in a folder named after it instead (training.mp4 -> training_frames/).
+        fps: Frames per second.
+        backend: "ffmpeg", "imageio" or "png". By default the first one available.
+    """
+
+    def __init__(self, filename, fps=10, backend=None):
+        self.filename = filename
+        self.fps = fps
+        if backend is None:
+            backend = "ffmpeg" if shutil.which("ffmpeg") else "imageio" if imageio_available() else "png"
+        self.backend = backend
+        self.frame_count = 0
+        self.process = None
+        self.writer = None
+        self.frame_shape = None
+        if backend == "png":
+            self.directory = os.path.splitext(filename)[0] + "_frames"
+            os.makedirs(self.directory, exist_ok=True)
+        elif backend == "imageio":
+            import imageio
+            self.writer = imageio.get_writer(filename, fps=fps)
+        elif backend != "ffmpeg":
+            raise ValueError(f"Unknown backend {backend!r}, use 'ffmpeg', 'imageio' or 'png'")
+
+    def start_ffmpeg(self, height, width):
+        command = ["ffmpeg", "-y", "-loglevel", "error",
+                   "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(self.fps), "-i", "-"]
+        if self.filename.endswith(".gif"):
+            command += ["-vf", "split[a][b];[a]palettegen[p];[b][p]paletteuse"]
+        else:
+            # Most mp4 players need even sizes and yuv420p
+            command += ["-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-pix_fmt", "yuv420p"]
+        self.process = subprocess.Popen(command + [self.filename], stdin=subprocess.PIPE)
+
+    def write(self, frame):
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        if self.frame_shape is None:
+            self.frame_shape = frame.shape
+        elif frame.shape != self.frame_shape:
+            raise ValueError(f"Every frame must be {self.frame_shape}, got {frame.shape}")
+
+        if self.backend == "ffmpeg":
+            if self.process is None:
+                self.start_ffmpeg(*frame.shape[:2])
+            self.process.stdin.write(frame.tobytes())
+        elif self.backend == "imageio":
+            self.writer.append_data(frame)
+        else:
+            write_png(os.path.join(self.directory, f"frame_{self.frame_count:06d}.png"), frame)
+        self.frame_count += 1
+
+    def close(self):
+        if self.process is not None:
+            self.process.stdin.close()
+            self.process.wait()
+            self.process = None
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def imageio_available():
+    try:
+        import imageio  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class FrameRecorder(Callback):
+    """
+    A train_agent callback that adds a frame to a VideoWriter every few episodes, showing the
+    agent's q-values as a heatmap and its greedy path.
+    """
+
+    def __init__(self, maze, writer, every=1, scale=4, max_steps=None):
+        self.maze = maze
+        self.writer = writer
+        self.every = every
+        self.scale = scale
+        self.max_steps = max_steps
+
+    def on_episode_end(self, agent, metrics):
+        if metrics.num_episodes() % self.every == 0:
+            path = greedy_path(agent, self.maze, self.max_steps)
+            self.writer.write(render_frame(self.maze, path, q_value_grid(agent), self.scale))
@@ -0,0 +1,189 @@
+"""
+Learning from the same experience more than once.
+
+Normally the agent learns from each step exactly once, straight after taking it. With experience
+replay every step is stored in a ReplayBuffer, and the agent learns from a random handful (a
+minibatch) of stored steps at a time. Old steps get used again and again, so the agent needs far
+fewer steps through the maze to learn the same amount.
+
+A whole minibatch is learned in one go with numpy (batched_q_update) instead of one update_q_table
+call per step.
+"""
+import numpy as np
+
+from fast_simulate import reward_table
+from metrics import TrainingMetrics, PrintProgress
+
+
+class ReplayBuffer:
+    """
+    Holds the latest capacity steps. Once it is full each new step replaces the oldest one.
+
+    A step is stored as integers: the state id, the action index, the reward, the next state id and
+    whether the episode ended.
+    """
+
+    def __init__(self, capacity, random_state=None):
+        self.capacity = capacity
+        self.states = np.zeros(capacity, dtype=np.int32)
+        self.actions = np.zeros(capacity, dtype=np.int32)
+        self.rewards = np.zeros(capacity, dtype=np.float64)
+        self.next_states = np.zeros(capacity, dtype=np.int32)
+        self.dones = np.zeros(capacity, dtype=bool)
+        self.size = 0
+        self.next_ix = 0  # Where the next step goes
+        # np.random.mtrand._rand is the generator behind np.random.seed(), so seeding that makes runs repeat
+        self.random_state = random_state if random_state is not None else np.random.mtrand._rand
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state_id, action_idx, reward, next_state_id, is_done):
+        ix = self.next_ix
+        self.states[ix] = state_id
+        self.actions[ix] = action_idx
+        self.rewards[ix] = reward
+        self.next_states[ix] = next_state_id
+        self.dones[ix] = is_done
+        self.next_ix = (ix + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def add_batch(self, state_ids, action_idxs, rewards, next_state_ids, is_done):
+        """
+        Add many steps at once. If there are more than capacity only the last capacity are kept.
+        """
+        count = len(state_ids)
+        keep = slice(max(count - self.capacity, 0), count)
+        ixs = (self.next_ix + np.arange(max(count - self.capacity, 0), count)) % self.capacity
+        self.states[ixs] = np.asarray(state_ids)[keep]
+        self.actions[ixs] = np.asarray(action_idxs)[keep]
+        self.rewards[ixs] = np.asarray(rewards)[keep]
+        self.next_states[ixs] = np.asarray(next_state_ids)[keep]
+        self.dones[ixs] = np.asarray(is_done)[keep]
+        self.next_ix = (self.next_ix + count) % self.capacity
+        self.size = min(self.size + count, self.capacity)
+
+    def sample(self, batch_size):
+        """
+        A minibatch of batch_size stored steps picked uniformly at random (with replacement).
+
+        Returns:
+            (states, actions, rewards, next_states, dones) arrays
+        """
+        ixs = self.random_state.randint(self.size, size=batch_size)
+        return self.states[ixs], self.actions[ixs], self.rewards[ixs], self.next_states[ixs], self.dones[ixs]
+
+
+def buffer_from_trajectories(trajectories, maze, reward_map, capacity=None, random_state=None):
+    """
+    Fill a ReplayBuffer with the steps saved by a trajectories.TrajectoryWriter.
+
+    The recording only has the state before each step, so the next state is looked up in the maze's
+    next_state table.
+    """
+    rewards = reward_table(reward_map)
+    capacity = capacity if capacity is not None else max(len(trajectories), 1)
+    buffer = ReplayBuffer(capacity, random_state)
+    for chunk in trajectories.chunks():
+        states = chunk["state"].astype(np.int64)
+        actions = chunk["action"].astype(np.int64)
+        buffer.add_batch(states, actions, rewards[chunk["reward_code"]], maze.next_state[states, actions], chunk["done"])
+    return buffer
+
+
+def batched_q_update(q_table, states, actions, rewards, next_states, dones, learning_rate, discount_factor):
+    """
+    Apply a minibatch of Q-learning updates to q_table in one go.
+
+    q_table is a (rows, num_actions) array, for a QLearningAgent that is agent.q_table.reshape(-1, num_actions),
+    and is updated in place. States are turned into rows with state % rows, so a position only q_table on a
+    KeyMaze uses the position.
+
+    Every update is worked out from the q-values as they were before the minibatch. When the same
+    (state, action) turns up more than once in a minibatch its updates are averaged, so it moves
+    by learning_rate like any other pair instead of by learning_rate times the number of copies.
+    """
+    num_rows, num_actions = q_table.shape
+    rows = states % num_rows
+    next_rows = next_states % num_rows
+
+    # Nothing comes after the end of an episode
+    best_next_q_values = np.where(dones, 0.0, q_table[next_rows].max(axis=1))
+    flat_ixs = rows * num_actions + actions
+    td_errors = rewards + discount_factor * best_next_q_values - q_table.reshape(-1)[flat_ixs]
+
+    # Add up the errors of each (state, action) and how many times it came up, then average
+    unique_ixs, inverse = np.unique(flat_ixs, return_inverse=True)
+    totals = np.zeros(len(unique_ixs))
+    np.add.at(totals, inverse, td_errors)
+    counts = np.bincount(inverse, minlength=len(unique_ixs))
+    q_table.reshape(-1)[unique_ixs] += learning_rate * totals / counts
+
+
+def train_agent_replay(agent,
+                       maze,
+                       reward_map,
+                       buffer=None,
+                       batch_size=64,
+                       updates_per_step=1,
+                       warm_up=None,
+                       callbacks=None,
+                       max_steps=500000):
+    """
+    Train the agent like train_agent, but learn from minibatches sampled from a replay buffer
+    instead of from each step as it happens.
+
+    Args:
+        agent: A QLearningAgent (anything with get_action and a q_table array).
+        maze: The maze to train in.
+        reward_map: Reward for each reward signal, e.g. {"wall": -10, "step": -1, "goal": 100}.
+        buffer: The ReplayBuffer to use. A new one holding 100000 steps is made if not given.
+        batch_size: Steps in each minibatch.
+        updates_per_step: How many minibatches to learn from after every step in the maze.
+        warm_up: Steps to collect before starting to learn, batch_size by default.
+        callbacks: Told about every episode as it finishes, see metrics.py. Progress is printed by default.
+        max_steps: The most steps allowed in a single episode.
+
+    Returns:
+        A TrainingMetrics with the reward, steps and wall hits of every episode.
+    """
+    if callbacks is None:
+        callbacks = [PrintProgress()]
+    if buffer is None:
+        buffer = ReplayBuffer(100000)
+    if warm_up is None:
+        warm_up = batch_size
+
+    q_table = agent.q_table.reshape(-1, len(maze.get_actions()))
+    metrics = TrainingMetrics()
+
+    while not agent.terminate():
+        maze.reset()
+        is_done = False
+        episode_reward = 0
+        episode_step = 0
+        wall_hits = 0
+        while not is_done and episode_step < max_steps:
+            state_id = maze.get_state_index()
+            action = agent.get_action(maze.get_current_state())
+            _, reward_signal, is_done = maze.interact(action)
+            reward = reward_map.get(reward_signal, 0.0)
+            if reward_signal == "wall":
+                wall_hits += 1
+            buffer.add(state_id, maze.action_index[action], reward, maze.get_state_index(), is_done)
+
+            episode_reward += reward
+            episode_step += 1
+
+            if len(buffer) >= warm_up:
+                for _ in range(updates_per_step):
+                    batched_q_update(q_table, *buffer.sample(batch_size), agent.learning_rate, agent.discount_factor)
+
+        metrics.record_episode(episode_reward, episode_step, wall_hits)
+        agent.new_episode()
+        for callback in callbacks:
+            callback.on_episode_end(agent, metrics)
+
+    for callback in callbacks:
+        callback.on_train_end(agent, metrics)
+    return metrics
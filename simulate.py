@@ -1,4 +1,8 @@
-import matplotlib.pyplot as plt
+from collections import deque
+
+from metrics import TrainingMetrics, PrintProgress, PlotProgress
+from mazes.basic_maze import figure_size
+
 
 def run_single_simulation(agent, 
                    maze, 
@@ -7,21 +11,44 @@ def run_single_simulation(agent,
                     "wall": -10, "step": -1, "goal": 100
                    },
                    max_steps=500000, 
-                   debug=False):
+                   debug=False,
+                   verbose=True,
+                   stats=None,
+                   profiler=None,
+                   max_path_length=None,
+                   recorder=None,
+                   greedy=False):
     # Initialize the agent's current state to the maze's start position
     maze.reset()
 
+    # An optional instrumentation.Profiler times each part of every step
+    if profiler is not None:
+        profiler.start_episode()
+
     is_done = False
     episode_reward = 0
     episode_step = 0
-    path = [maze.current_position]
+    wall_hits = 0
+    # The path holds at most max_path_length of the latest positions, and isn't kept at all for 0.
+    # A long run can be saved to disk instead with a trajectories.TrajectoryWriter as the recorder.
+    if max_path_length == 0:
+        path = None
+    else:
+        path = deque([maze.current_position], maxlen=max_path_length)
 
     # Continue until the episode is done 
     while not is_done and episode_step < max_steps:
         current_state = maze.get_current_state()
+        if recorder is not None:
+            state_id = maze.get_state_index()
 
-        # Get the agent's action for the current state using its Q-table
-        action = agent.get_action(current_state)
+        # Get the agent's action for the current state using its Q-table (never exploring if greedy)
+        if greedy:
+            action = agent.greedy_action(current_state)
+        else:
+            action = agent.get_action(current_state)
+        if profiler is not None:
+            profiler.lap("action")
 
         if debug:
             print(f"current state: {current_state}")
@@ -29,6 +56,8 @@ def run_single_simulation(agent,
             print(f"action : {action}")
 
         next_state, reward_signal, is_done = maze.interact(action)
+        if profiler is not None:
+            profiler.lap("step")
 
         # Give the agent a reward based on the reward signal. 
         # Penalties for hitting walls and taking steps.
@@ -37,13 +66,21 @@ def run_single_simulation(agent,
             reward = reward_map[reward_signal]
         else:
             reward = 0.0
+        if profiler is not None:
+            profiler.lap("reward")
+            profiler.count(reward_signal)
+        if recorder is not None:
+            recorder.record(state_id, maze.action_index[action], reward_signal, is_done)
 
         # Add the current position to the path if the agent has reached the goal or taken a step.
         if reward_signal != "wall":
-            path.append(maze.current_position)
+            if path is not None:
+                path.append(maze.current_position)
             #is_done = True
         #if reward_signal == "step":
             #path.append(maze.current_position)
+        else:
+            wall_hits += 1
         
         # Update the cumulative reward and step count for the episode
         episode_reward += reward
@@ -52,10 +89,23 @@ def run_single_simulation(agent,
         # Update the agent's Q-table if training is enabled
         if train == True:
             agent.update_q_table(current_state, action, next_state, reward)
+            if profiler is not None:
+                profiler.lap("update")
+
+    if profiler is not None:
+        profiler.end_episode(episode_step)
+    if recorder is not None:
+        recorder.end_episode()
+
+    # Hand back any extra counts the caller asked for
+    if stats is not None:
+        stats["wall_hits"] = wall_hits
+        stats["reached_goal"] = is_done
 
     # Return the cumulative episode reward, total number of steps, and the agent's path during the simulation
-    print(f"episode reward: {episode_reward}, episode step: {episode_step}")
-    return episode_reward, episode_step, path
+    if verbose:
+        print(f"episode reward: {episode_reward}, episode step: {episode_step}")
+    return episode_reward, episode_step, list(path) if path is not None else []
 
 
 # This function evaluates an agent's performance in the maze. The function simulates the agent's movements in the maze,
@@ -81,23 +131,22 @@ def test_agent(agent,
     print("Total reward:", episode_reward)
 
     if plot:
+        import matplotlib.pyplot as plt
 
         # Clear the existing plot if any
         if plt.gcf().get_axes():
             plt.cla()
 
-        # Visualize the maze using matplotlib
-        plt.figure(figsize=(maze.maze_width,maze.maze_height))
-        plt.imshow(maze.maze, cmap='gray')
+        from rendering import render_frame
+
+        # Draw the maze with the agent's path in blue as one picture (see rendering.py)
+        plt.figure(figsize=figure_size(maze.maze_width, maze.maze_height))
+        plt.imshow(render_frame(maze, path))
 
         # Mark the start position (red 'S') and goal position (green 'G') in the maze
         plt.text(maze.start_position[0], maze.start_position[1], 'S', ha='center', va='center', color='red', fontsize=20)
         plt.text(maze.goal_position[0], maze.goal_position[1], 'G', ha='center', va='center', color='green', fontsize=20)
 
-        # Mark the agent's path with blue '#' symbols
-        for position in path:
-            plt.text(position[0], position[1], "#", va='center', color='blue', fontsize=20)
-
         # Remove axis ticks and grid lines for a cleaner visualization
         plt.xticks([]), plt.yticks([])
         plt.grid(color='black', linewidth=2)
@@ -109,44 +158,53 @@ def test_agent(agent,
 """
 Below is the code for Q-learning, a basic reinforcement learning algorithm. This is used to train the agent. This code updates the Q-values based on the rewards it receives during exploration.  You do not need to change this code for your engineering project.
 """
-def train_agent(agent, maze, reward_map):
-    # Lists to store the data for plotting
-    episode_rewards = []
-    episode_steps = []
+def train_agent(agent, maze, reward_map, callbacks=None, max_steps=500000, profiler=None, recorder=None, stopping=None):
+    """
+    Train the agent until it has run all of its episodes.
+
+    callbacks are told about every episode as it finishes (see metrics.py). By default progress is
+    printed and plotted. Pass callbacks=[] to train quietly, for example on a server.
+    max_steps is the most steps allowed in a single episode.
+    Pass an instrumentation.Profiler as profiler to find out where the training time goes, and a
+    trajectories.TrajectoryWriter as recorder to save every step to disk.
+    stopping is a list of stopping criteria (see stopping.py). Training ends as soon as one of them
+    is met, and the metrics say which one and how many episodes were saved.
+
+    Returns a TrainingMetrics with the reward, steps and wall hits of every episode.
+    """
+    if callbacks is None:
+        callbacks = [PrintProgress(), PlotProgress()]
+
+    # Everything we measure during training ends up in here
+    metrics = TrainingMetrics()
+    stats = {}
 
     # Loop over the specified number of episodes
     while not agent.terminate():
-        episode_reward, episode_step, path = run_single_simulation(agent, maze, train=True, reward_map=reward_map)
+        # The path isn't used during training, so it isn't kept
+        episode_reward, episode_step, path = run_single_simulation(agent, maze, train=True, reward_map=reward_map, max_steps=max_steps, verbose=False, stats=stats,
+                                                                   profiler=profiler, max_path_length=0, recorder=recorder)
 
-        # Store the episode's cumulative reward and the number of steps taken in their respective lists
-        episode_rewards.append(episode_reward)
-        episode_steps.append(episode_step)
+        # Store the episode's cumulative reward, the number of steps taken and the number of walls hit
+        metrics.record_episode(episode_reward, episode_step, stats["wall_hits"])
         agent.new_episode()
 
-        #print("testing agent : ")
-        #test_agent(agent, maze, num_episodes=episode, plot=False)
-
-    # Plotting the data after training is completed
-    plt.figure(figsize=(10, 5))
+        for callback in callbacks:
+            callback.on_episode_end(agent, metrics)
 
-    plt.subplot(1, 2, 1)
-    plt.plot(episode_rewards)
-    plt.xlabel('Episode')
-    plt.ylabel('Cumulative Reward')
-    plt.title('Reward per Episode')
+        # Stop as soon as any of the stopping criteria is met
+        for criterion in stopping or []:
+            if criterion.should_stop(agent, metrics):
+                metrics.stop_reason = str(criterion)
+                metrics.episodes_saved = agent.num_episodes - agent.current_episode
+                break
+        if metrics.stop_reason is not None:
+            break
 
-    average_reward = sum(episode_rewards) / len(episode_rewards)
-    print(f"The average reward is: {average_reward}")
-
-    plt.subplot(1, 2, 2)
-    plt.plot(episode_steps)
-    plt.xlabel('Episode')
-    plt.ylabel('Steps Taken')
-    #plt.ylim(0, 100)
-    plt.title('Steps per Episode')
+        #print("testing agent : ")
+        #test_agent(agent, maze, num_episodes=episode, plot=False)
 
-    average_steps = sum(episode_steps) / len(episode_steps)
-    print(f"The average steps is: {average_steps}")
+    for callback in callbacks:
+        callback.on_train_end(agent, metrics)
 
-    plt.tight_layout()
-    plt.show()
\ No newline at end of file
+    return metrics
@@ -0,0 +1,134 @@
+"""
+Stopping training once the agent has stopped getting better.
+
+train_agent normally runs every one of the agent's episodes, even when it found the best path long
+ago. Pass it some stopping criteria and it stops as soon as any one of them says so:
+ - GreedyPathStable: the agent's best path (no exploring) has been the same length for a while
+ - QChangeBelow: no q-value changed by more than a tolerance in a while
+ - RewardPlateau: the average reward of the latest episodes has stopped going up
+
+    metrics = train_agent(agent, maze, reward_map, stopping=[GreedyPathStable(maze, reward_map)])
+    print(metrics.stop_reason, metrics.episodes_saved)
+"""
+import numpy as np
+
+from simulate import run_single_simulation
+
+
+def greedy_evaluation(agent, maze, reward_map, max_steps=None):
+    """
+    Run one episode that always takes the agent's best action, without learning or printing.
+
+    numpy's random numbers are put back afterwards, so checking the agent in the middle of
+    training doesn't change how the training goes.
+
+    Args:
+        max_steps: Most steps to try, by default the number of states in the maze (a best path
+            can't be longer than that without going round in circles).
+
+    Returns:
+        episode_reward, episode_step and whether the goal was reached
+    """
+    random_state = np.random.get_state()
+    stats = {}
+    episode_reward, episode_step, _ = run_single_simulation(agent, maze, train=False, reward_map=reward_map,
+                                                            max_steps=max_steps if max_steps is not None else maze.num_states,
+                                                            verbose=False, stats=stats, max_path_length=0, greedy=True)
+    np.random.set_state(random_state)
+    return episode_reward, episode_step, stats["reached_goal"]
+
+
+class StoppingCriterion:
+    """
+    Looked at after every training episode. should_stop returns True to end training.
+    """
+
+    def should_stop(self, agent, metrics):
+        return False
+
+    def __str__(self):
+        return type(self).__name__
+
+
+class GreedyPathStable(StoppingCriterion):
+    """
+    Stop when the greedy path has reached the goal with the same number of steps patience checks in a row.
+    A check is done every `every` episodes. Each check walks the greedy path, which can take as many
+    steps as the maze has states, so checking after every episode would cost more than the training.
+    """
+
+    def __init__(self, maze, reward_map, patience=5, every=10, max_steps=None):
+        self.maze = maze
+        self.reward_map = reward_map
+        self.patience = patience
+        self.every = every
+        self.max_steps = max_steps
+        self.path_lengths = []  # Greedy path length at each check, None when it didn't reach the goal
+        self.stable_checks = 0
+
+    def should_stop(self, agent, metrics):
+        if metrics.num_episodes() % self.every != 0:
+            return False
+        _, episode_step, reached_goal = greedy_evaluation(agent, self.maze, self.reward_map, self.max_steps)
+        path_length = episode_step if reached_goal else None
+        if path_length is not None and self.path_lengths and path_length == self.path_lengths[-1]:
+            self.stable_checks += 1
+        else:
+            self.stable_checks = 1 if path_length is not None else 0
+        self.path_lengths.append(path_length)
+        return self.stable_checks >= self.patience
+
+    def __str__(self):
+        return f"greedy path stable at {self.path_lengths[-1]} steps for {self.patience} checks"
+
+
+class QChangeBelow(StoppingCriterion):
+    """
+    Stop when no q-value has changed by more than tolerance over an episode, patience episodes in a row.
+    Works with agents that keep their q-values in an array (QLearningAgent, CompactQLearningAgent).
+    """
+
+    def __init__(self, tolerance=1e-3, patience=3):
+        self.tolerance = tolerance
+        self.patience = patience
+        self.previous = None
+        self.calm_episodes = 0
+        self.max_changes = []
+
+    def should_stop(self, agent, metrics):
+        q_table = np.asarray(agent.q_table)
+        if self.previous is None:
+            max_change = np.inf
+        else:
+            # A CompactQLearningAgent's table grows, new rows count as a change from zero
+            rows = min(len(self.previous), len(q_table))
+            max_change = np.abs(q_table[:rows] - self.previous[:rows]).max(initial=0.0)
+            max_change = max(max_change, np.abs(q_table[rows:]).max(initial=0.0))
+        self.previous = q_table.copy()
+        self.max_changes.append(float(max_change))
+        self.calm_episodes = self.calm_episodes + 1 if max_change <= self.tolerance else 0
+        return self.calm_episodes >= self.patience
+
+    def __str__(self):
+        return f"q-values changed by less than {self.tolerance} for {self.patience} episodes"
+
+
+class RewardPlateau(StoppingCriterion):
+    """
+    Stop when the average reward of the latest window episodes is no more than tolerance better
+    than the average of the window before it.
+    """
+
+    def __init__(self, window=20, tolerance=1.0):
+        self.window = window
+        self.tolerance = tolerance
+
+    def should_stop(self, agent, metrics):
+        if metrics.num_episodes() < 2 * self.window:
+            return False
+        latest = np.mean(metrics.episode_rewards[-self.window:])
+        before = np.mean(metrics.episode_rewards[-2 * self.window:-self.window])
+        return latest - before <= self.tolerance
+
+    def __str__(self):
+        return f"average reward over {self.window} episodes improved by less than {self.tolerance}"
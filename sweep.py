@@ -0,0 +1,198 @@
+"""
+Try lots of different agent settings at once.
+
+Instead of changing learning_rate, discount_factor, ... by hand in the notebook and training again,
+give run_sweep a grid of settings and it trains an agent for every combination, for every seed,
+spread across all of the computer's cores.
+
+Every (settings, seed) job gets its own random numbers made from the seed, so a job always gives
+the same result no matter which core it runs on or what order the jobs finish in. For a given seed
+the maze and the agent's random numbers are the same for every combination of settings, so the
+settings are compared on an even footing.
+
+From the command line:
+    python sweep.py --maze prims_maze --maze-args 20 --learning-rate 0.1 0.5 --discount-factor 0.9 0.99 --seeds 0 1 2
+"""
+import argparse
+import inspect
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from agents import QLearningAgent
+from fast_simulate import train_agent_fast
+from mazes import maze_constructors
+from mazes.env import default_reward_map
+
+
+# The settings that can be swept, with the value used when the grid does not mention them
+default_settings = {
+    "learning_rate": 0.1,
+    "discount_factor": 0.9,
+    "exploration_start": 1.0,
+    "exploration_end": 0.01,
+    "reward_map": default_reward_map,
+}
+
+
+def parameter_grid(grid):
+    """
+    Turn {"learning_rate": [0.1, 0.5], "discount_factor": [0.9]} into a list of settings dictionaries,
+    one for every combination. Settings not in the grid get their default value.
+    """
+    unknown = set(grid) - set(default_settings)
+    if unknown:
+        raise ValueError(f"Unknown settings in the grid: {sorted(unknown)}")
+
+    names = list(grid)
+    configs = []
+    for values in itertools.product(*(grid[name] for name in names)):
+        config = dict(default_settings)
+        config.update(zip(names, values))
+        configs.append(config)
+    return configs
+
+
+def run_job(maze_factory, maze_args, config, seed, num_episodes, max_steps):
+    """
+    Build the maze and train one agent with one set of settings. This runs inside a worker process.
+    """
+    maze_seed, agent_seed = np.random.SeedSequence(seed).spawn(2)
+
+    # Random maze constructors take a seed, fixed ones like get_first_example_maze don't
+    if "seed" in inspect.signature(maze_factory).parameters:
+        maze = maze_factory(*maze_args, seed=maze_seed)
+    else:
+        maze = maze_factory(*maze_args)
+
+    agent = QLearningAgent(maze,
+                           maze.get_actions(),
+                           learning_rate=config["learning_rate"],
+                           discount_factor=config["discount_factor"],
+                           exploration_start=config["exploration_start"],
+                           exploration_end=config["exploration_end"],
+                           num_episodes=num_episodes)
+    random_state = np.random.RandomState(np.random.MT19937(agent_seed))
+    return train_agent_fast(agent, maze, config["reward_map"], max_steps=max_steps, random_state=random_state)
+
+
+class SweepResult:
+    """
+    Everything a sweep produced.
+
+    rewards[config, seed, episode] and steps[config, seed, episode] hold the training curves,
+    configs[config] is the settings used and seeds[seed] is the seed used.
+    """
+
+    def __init__(self, configs, seeds, rewards, steps):
+        self.configs = configs
+        self.seeds = seeds
+        self.rewards = rewards
+        self.steps = steps
+
+    def mean_rewards(self):
+        """
+        Average reward per episode for each set of settings, averaged over the seeds.
+        """
+        return self.rewards.mean(axis=1)
+
+    def mean_steps(self):
+        """
+        Average steps per episode for each set of settings, averaged over the seeds.
+        """
+        return self.steps.mean(axis=1)
+
+    def save(self, path):
+        np.savez_compressed(path,
+                            configs=json.dumps(self.configs),
+                            seeds=np.asarray(self.seeds),
+                            rewards=self.rewards,
+                            steps=self.steps)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(json.loads(str(data["configs"])), data["seeds"].tolist(), data["rewards"], data["steps"])
+
+
+def run_sweep(maze_factory,
+              grid,
+              seeds=(0,),
+              maze_args=(),
+              num_episodes=100,
+              max_steps=500000,
+              max_workers=None):
+    """
+    Train an agent for every combination of settings in the grid and every seed.
+
+    Args:
+        maze_factory: Function that builds the maze, e.g. prims_maze from mazes/maze_constructors.py.
+        grid: Dictionary of setting name -> list of values to try (see parameter_grid).
+        seeds: Seeds to run every set of settings with.
+        maze_args: Arguments for maze_factory, e.g. (20,) for a 20x20 prims_maze.
+        num_episodes: Number of training episodes for each agent.
+        max_steps: Most steps allowed in a single episode.
+        max_workers: Number of worker processes, by default one per core.
+
+    Returns:
+        A SweepResult with the reward and step curves of every job.
+    """
+    configs = parameter_grid(grid)
+    seeds = list(seeds)
+    rewards = np.zeros((len(configs), len(seeds), num_episodes))
+    steps = np.zeros((len(configs), len(seeds), num_episodes), dtype=np.int64)
+
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        jobs = {}
+        for config_ix, config in enumerate(configs):
+            for seed_ix, seed in enumerate(seeds):
+                job = executor.submit(run_job, maze_factory, tuple(maze_args), config, seed, num_episodes, max_steps)
+                jobs[job] = (config_ix, seed_ix)
+
+        for job, (config_ix, seed_ix) in jobs.items():
+            rewards[config_ix, seed_ix], steps[config_ix, seed_ix] = job.result()
+
+    return SweepResult(configs, seeds, rewards, steps)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train agents for every combination of settings.")
+    parser.add_argument("--maze", default="prims_maze", help="Maze constructor from mazes/maze_constructors.py")
+    parser.add_argument("--maze-args", nargs="*", type=int, default=[10], help="Arguments for the maze constructor")
+    parser.add_argument("--learning-rate", nargs="+", type=float, default=[default_settings["learning_rate"]])
+    parser.add_argument("--discount-factor", nargs="+", type=float, default=[default_settings["discount_factor"]])
+    parser.add_argument("--exploration-start", nargs="+", type=float, default=[default_settings["exploration_start"]])
+    parser.add_argument("--exploration-end", nargs="+", type=float, default=[default_settings["exploration_end"]])
+    parser.add_argument("--reward-map", nargs="+", type=json.loads, default=[default_reward_map],
+                        help='Reward maps as JSON, e.g. \'{"wall": -10, "step": -1, "goal": 100}\'')
+    parser.add_argument("--seeds", nargs="+", type=int, default=[0])
+    parser.add_argument("--episodes", type=int, default=100)
+    parser.add_argument("--max-steps", type=int, default=500000)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", default="sweep.npz", help="Where to save the results")
+    args = parser.parse_args()
+
+    grid = {
+        "learning_rate": args.learning_rate,
+        "discount_factor": args.discount_factor,
+        "exploration_start": args.exploration_start,
+        "exploration_end": args.exploration_end,
+        "reward_map": args.reward_map,
+    }
+    result = run_sweep(getattr(maze_constructors, args.maze), grid,
+                       seeds=args.seeds,
+                       maze_args=args.maze_args,
+                       num_episodes=args.episodes,
+                       max_steps=args.max_steps,
+                       max_workers=args.workers)
+    result.save(args.output)
+
+    for config, mean_rewards, mean_steps in zip(result.configs, result.mean_rewards(), result.mean_steps()):
+        print(f"{config} : average reward {mean_rewards.mean():.1f}, average steps {mean_steps.mean():.1f}")
+
+
+if __name__ == "__main__":
+    main()
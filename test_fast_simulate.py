@@ -0,0 +1,84 @@
+"""
+train_agent_fast promises exactly the same training as train_agent: the same q_table, the same
+episode rewards and steps, and numpy's random numbers left in the same place afterwards. It gets
+there by copying how np.random.RandomState turns its raw numbers into rand() and randint(), so
+these tests check that promise still holds for the python loop and the numba loop, with float64,
+float32 and float16 q_tables.
+
+    python -m pytest -q
+"""
+import numpy as np
+import pytest
+
+from agents import QLearningAgent
+from benchmark import make_key_maze
+from fast_simulate import round_to_half, run_episodes_numba, train_agent_fast
+from mazes.maze_constructors import prims_maze
+from simulate import train_agent
+
+
+reward_map = {"wall": -10, "step": -1, "goal": 100}
+
+
+def make_mazes():
+    maze = prims_maze(9, seed=0)
+    return {"maze": maze, "key maze": make_key_maze(maze)}
+
+
+def train_legacy(maze, num_episodes, seed, dtype=np.float64):
+    agent = QLearningAgent(maze, maze.get_actions(), num_episodes=num_episodes, dtype=dtype)
+    np.random.seed(seed)
+    metrics = train_agent(agent, maze, reward_map, callbacks=[])
+    return agent, metrics.episode_rewards, metrics.episode_steps, np.random.get_state()
+
+
+def train_fast(maze, num_episodes, seed, use_numba, dtype=np.float64):
+    agent = QLearningAgent(maze, maze.get_actions(), num_episodes=num_episodes, dtype=dtype)
+    np.random.seed(seed)
+    episode_rewards, episode_steps = train_agent_fast(agent, maze, reward_map, use_numba=use_numba)
+    return agent, episode_rewards, episode_steps, np.random.get_state()
+
+
+use_numba_options = [
+    False,
+    pytest.param(True, marks=pytest.mark.skipif(run_episodes_numba is None, reason="numba is not installed")),
+]
+
+
+@pytest.mark.parametrize("maze_name", ["maze", "key maze"])
+@pytest.mark.parametrize("use_numba", use_numba_options)
+@pytest.mark.parametrize("dtype", [np.float64, np.float32, np.float16])
+def test_same_as_train_agent(maze_name, use_numba, dtype):
+    maze = make_mazes()[maze_name]
+    legacy_agent, legacy_rewards, legacy_steps, legacy_random_state = train_legacy(maze, 30, seed=4, dtype=dtype)
+    fast_agent, fast_rewards, fast_steps, fast_random_state = train_fast(maze, 30, seed=4, use_numba=use_numba, dtype=dtype)
+
+    assert fast_agent.q_table.dtype == dtype
+    assert np.array_equal(fast_agent.q_table, legacy_agent.q_table)
+    assert np.array_equal(fast_rewards, legacy_rewards)
+    assert np.array_equal(fast_steps, legacy_steps)
+    assert fast_agent.current_episode == legacy_agent.current_episode
+    # The random numbers carry on from the same place, so whatever comes next doesn't change either
+    assert legacy_random_state[0] == fast_random_state[0]
+    assert np.array_equal(legacy_random_state[1], fast_random_state[1])
+    assert legacy_random_state[2:] == fast_random_state[2:]
+
+
+def test_round_to_half_matches_numpy():
+    values = np.concatenate([np.random.default_rng(0).normal(scale=scale, size=2000) for scale in (1e-6, 1e-3, 1, 100, 1e5)])
+    values = np.concatenate([values, [0.0, 65504.0, 65519.0, 65520.0, -70000.0, 2.0 ** -25, 3 * 2.0 ** -26]]).astype(np.float32)
+    with np.errstate(over="ignore"):
+        expected = values.astype(np.float16).astype(np.float32)
+    assert np.array_equal([round_to_half(value) for value in values], expected)
+
+
+def test_small_blocks_give_the_same_result():
+    # Running out of random numbers part way through an episode must not change anything
+    maze = make_mazes()["maze"]
+    results = []
+    for block_size in (7, 1 << 16):
+        agent = QLearningAgent(maze, maze.get_actions(), num_episodes=10)
+        np.random.seed(1)
+        train_agent_fast(agent, maze, reward_map, block_size=block_size, use_numba=False)
+        results.append(agent.q_table)
+    assert np.array_equal(results[0], results[1])
@@ -0,0 +1,165 @@
+"""
+Saving every step of a long training run to disk, and reading it back.
+
+A TrajectoryWriter collects steps in small fixed size buffers and appends them to one binary file
+per column whenever a buffer fills up, so recording a run of millions of steps only ever holds one
+buffer in memory. The columns are:
+ - episode: which episode the step was in
+ - state: the integer state id before the step (see Maze.state_index)
+ - action: the index of the action in get_actions()
+ - reward_code: the reward code from mazes.env (STEP, WALL, GOAL, ...)
+ - done: whether the step ended the episode
+
+A TrajectoryReader opens those files with np.memmap, so looking through them doesn't load them
+into memory: numpy reads the parts that are used straight from the file.
+
+    with TrajectoryWriter("run") as recorder:
+        train_agent(agent, maze, reward_map, recorder=recorder)
+    trajectories = TrajectoryReader("run")
+    visits = trajectories.visit_counts(maze.num_states)
+"""
+import json
+import os
+
+import numpy as np
+
+from mazes.env import REWARD_SIGNALS
+
+
+columns = {
+    "episode": np.int32,
+    "state": np.int32,
+    "action": np.uint8,
+    "reward_code": np.int8,
+    "done": np.bool_,
+}
+
+reward_codes = {signal: code for code, signal in enumerate(REWARD_SIGNALS)}
+
+
+class TrajectoryWriter:
+
+    def __init__(self, directory, chunk_size=1 << 16):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        os.makedirs(directory, exist_ok=True)
+        self.buffers = {name: np.empty(chunk_size, dtype=dtype) for name, dtype in columns.items()}
+        self.files = {name: open(os.path.join(directory, f"{name}.bin"), "wb") for name in columns}
+        self.buffered = 0   # Steps waiting in the buffers
+        self.length = 0     # Steps written to the files
+        self.episode = 0
+
+    def record(self, state_id, action_idx, reward_signal, is_done):
+        """
+        Add one step. reward_signal can be the name ("wall") or the reward code (WALL).
+        """
+        ix = self.buffered
+        self.buffers["episode"][ix] = self.episode
+        self.buffers["state"][ix] = state_id
+        self.buffers["action"][ix] = action_idx
+        self.buffers["reward_code"][ix] = reward_codes.get(reward_signal, reward_signal)
+        self.buffers["done"][ix] = is_done
+        self.buffered += 1
+        if self.buffered == self.chunk_size:
+            self.flush()
+
+    def end_episode(self):
+        self.episode += 1
+
+    def flush(self):
+        """
+        Write the buffered steps to the files, along with meta.json so the run can be read so far.
+        """
+        if self.buffered:
+            for name, buffer in self.buffers.items():
+                buffer[:self.buffered].tofile(self.files[name])
+            self.length += self.buffered
+            self.buffered = 0
+        for column_file in self.files.values():
+            column_file.flush()
+        meta = {
+            "length": self.length,
+            "episodes": self.episode,
+            "columns": {name: np.dtype(dtype).str for name, dtype in columns.items()},
+            "reward_signals": REWARD_SIGNALS,
+        }
+        with open(os.path.join(self.directory, "meta.json"), "w") as meta_file:
+            json.dump(meta, meta_file)
+
+    def close(self):
+        self.flush()
+        for column_file in self.files.values():
+            column_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class TrajectoryReader:
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, "meta.json")) as meta_file:
+            self.meta = json.load(meta_file)
+        self.length = self.meta["length"]
+        self.columns = {}
+        for name, dtype in self.meta["columns"].items():
+            path = os.path.join(directory, f"{name}.bin")
+            if self.length:
+                self.columns[name] = np.memmap(path, dtype=np.dtype(dtype), mode="r", shape=(self.length,))
+            else:
+                self.columns[name] = np.empty(0, dtype=np.dtype(dtype))
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def episode_starts(self):
+        """
+        Where each episode starts, plus the end of the last one, so episode i is
+        steps episode_starts[i]:episode_starts[i + 1].
+        """
+        episodes = self.columns["episode"]
+        starts = np.flatnonzero(episodes[1:] != episodes[:-1]) + 1
+        return np.concatenate([[0], starts, [self.length]]) if self.length else np.zeros(1, dtype=np.int64)
+
+    def episode(self, ix):
+        """
+        The steps of one episode, as views into the files.
+        """
+        starts = self.episode_starts()
+        start, stop = starts[ix], starts[ix + 1]
+        return {name: column[start:stop] for name, column in self.columns.items()}
+
+    def chunks(self, chunk_size=1 << 20):
+        """
+        Go through the steps a chunk at a time, to look at a run that doesn't fit in memory.
+        """
+        for start in range(0, self.length, chunk_size):
+            yield {name: column[start:start + chunk_size] for name, column in self.columns.items()}
+
+    def visit_counts(self, num_states, chunk_size=1 << 20):
+        """
+        How many steps were taken from each state.
+        """
+        counts = np.zeros(num_states, dtype=np.int64)
+        for chunk in self.chunks(chunk_size):
+            counts += np.bincount(chunk["state"], minlength=num_states)
+        return counts
+
+    def reward_counts(self):
+        """
+        How many times each reward signal came up, by name.
+        """
+        counts = np.bincount(self.columns["reward_code"], minlength=len(REWARD_SIGNALS)) if self.length else np.zeros(len(REWARD_SIGNALS), dtype=np.int64)
+        return dict(zip(self.meta["reward_signals"], counts.tolist()))
+
+    def positions(self, maze, start=0, stop=None):
+        """
+        The [x, y] positions of steps start:stop, like the path from run_single_simulation.
+        """
+        return [maze.position_from_index(int(state_id)) for state_id in self.columns["state"][start:stop]]